@@ -1,5 +1,5 @@
 from app.groq_client import GroqService
-from app.csv_store import log_assessment
+from app.assessments_store import log_assessment
 
 class DiagnosisAgent:
     """
@@ -10,13 +10,15 @@ class DiagnosisAgent:
     Groq's Llama 3.3 70B model.
     """
 
-    def generate_report(self, measurements: dict, combined_context: str) -> str:
+    async def generate_report(self, measurements: dict, combined_context: str, on_token=None) -> str:
         """
         Generate a structured surgical wound assessment.
 
         Args:
             measurements: dict with keys: length, width, depth, area, volume
             combined_context: combined text from vision caption + research
+            on_token: optional callback; when given, the report is requested via
+                Groq streaming completions and each text delta is passed to it
 
         Returns:
             str: Full structured clinical diagnostic report
@@ -26,6 +28,8 @@ class DiagnosisAgent:
         depth   = measurements.get("depth",  0)
         area    = measurements.get("area",   0)
         volume  = measurements.get("volume", 0)
+        perimeter = measurements.get("perimeter", 0)
+        regions = measurements.get("region_count", 1)
 
         prompt = f"""You are Clinivanta AI — a clinical-grade AI diagnostic engine specializing in wound assessment.
 
@@ -35,6 +39,8 @@ WOUND MEASUREMENTS (AI-calculated via YOLO segmentation + depth estimation):
   - Depth   : {depth} cm
   - Area    : {area} cm²
   - Volume  : {volume} cm³
+  - Perimeter: {perimeter} cm
+  - Separate wound regions: {regions}
 
 VISION & RESEARCH INTELLIGENCE:
 {combined_context[:1500]}
@@ -64,8 +70,14 @@ Step-by-step priority plan:
 
 Keep language precise, concise, and surgical-grade. Do NOT change the section headers."""
         try:
-            report = GroqService.get_mixtral_recommendation(prompt)
-            return report
+            if on_token is None:
+                report = await GroqService.get_mixtral_recommendation(prompt)
+                return report
+            tokens = []
+            async for token in GroqService.stream_mixtral_recommendation(prompt):
+                tokens.append(token)
+                on_token(token)
+            return "".join(tokens)
         except Exception as e:
             print(f"DiagnosisAgent error: {e}")
             return (
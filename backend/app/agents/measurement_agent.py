@@ -1,43 +1,221 @@
+import os
 import numpy as np
 
+# Heuristic scaling: Assuming standard 640x640 frame at 30cm distance
+# 1 pixel ≈ 0.04 cm. Override per camera setup with PIXEL_TO_CM.
+DEFAULT_PIXEL_TO_CM = float(os.environ.get("PIXEL_TO_CM", "0.04"))
+
+# Foreground blobs smaller than this (in pixels) are treated as segmentation noise
+MIN_REGION_PX = int(os.environ.get("MIN_REGION_PX", "25"))
+
+SQRT2 = np.sqrt(2)
+
+EMPTY_MEASUREMENTS = {"length": 0, "width": 0, "depth": 0, "area": 0, "volume": 0, "perimeter": 0, "region_count": 0, "regions": []}
+
+
+def find_runs(stack):
+    """
+    Horizontal foreground runs of an (N, H, W) boolean stack, in row-major order.
+    Returns (row, start, end): the global row (mask * H + y) and inclusive columns.
+    """
+    n, h, w = stack.shape
+    padded = np.zeros((n * h, w + 2), dtype=bool)
+    padded[:, 1:-1] = stack.reshape(n * h, w)
+    # Every row starts and ends on background, so value changes alternate start/stop
+    changes = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    starts, stops = changes[0::2], changes[1::2]
+    return starts // (w + 1), starts % (w + 1), stops % (w + 1) - 1
+
+
+def link_runs(row, start, end, h, w):
+    """
+    Pairs (upper, lower) of runs that touch across consecutive rows of the same mask,
+    with the number of columns they share.
+    """
+    # Runs are sorted by row then column, so these keys are sorted too
+    start_key = row * w + start
+    end_key = row * w + end
+    below = (row % h) < h - 1
+    first = np.searchsorted(end_key, (row + 1) * w + start, side="left")
+    last = np.searchsorted(start_key, (row + 1) * w + end, side="right")
+    count = np.where(below, np.maximum(last - first, 0), 0)
+
+    upper = np.repeat(np.arange(row.size), count)
+    offsets = np.repeat(np.cumsum(count) - count, count)
+    lower = np.repeat(first, count) + (np.arange(upper.size) - offsets)
+    shared = np.minimum(end[upper], end[lower]) - np.maximum(start[upper], start[lower]) + 1
+    return upper, lower, shared
+
+
+def label_runs(n_runs, upper, lower):
+    """
+    Connected components over runs (4-connectivity). Returns each run's root
+    (the smallest run index of its component).
+
+    Pure NumPy: roots are hooked to the smallest neighbouring root and paths are
+    compressed by pointer jumping until every link joins runs with the same root.
+    """
+    parent = np.arange(n_runs)
+    u, v = upper, lower
+    while u.size:
+        pu, pv = parent[u], parent[v]
+        differ = pu != pv
+        if not differ.any():
+            break
+        pu, pv = pu[differ], pv[differ]
+        # Hook: each root adopts the smallest root it touches
+        np.minimum.at(parent, np.maximum(pu, pv), np.minimum(pu, pv))
+        # Compress: point every run straight at its root
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        u, v = u[differ], v[differ]
+    return parent
+
+
+def _covered(row, start, end, query_row, query_col, w):
+    """Whether pixel (query_row, query_col) lies inside any run."""
+    start_key = row * w + start
+    i = np.searchsorted(start_key, query_row * w + query_col, side="right") - 1
+    i = np.maximum(i, 0)
+    return (row[i] == query_row) & (start[i] <= query_col) & (end[i] >= query_col)
+
+
 class MeasurementAgent:
-    def calculate_dimensions(self, mask):
+    def __init__(self, pixel_to_cm=None, min_region_px=MIN_REGION_PX):
+        self.pixel_to_cm = pixel_to_cm or DEFAULT_PIXEL_TO_CM
+        self.min_region_px = min_region_px
+
+    def calculate_dimensions(self, mask, pixel_to_cm=None):
         """
         Calculates physical dimensions from a binary mask.
-        In a real production app, we would use a reference object (like a coin) 
+        In a real production app, we would use a reference object (like a coin)
         or LiDAR depth sensor data to get an accurate pixel-to-cm ratio.
         """
-        # Simple bounding box for length/width
-        rows = np.any(mask, axis=1)
-        cols = np.any(mask, axis=0)
-        
-        if not np.any(rows) or not np.any(cols):
-            return {"length": 0, "width": 0, "depth": 0, "area": 0, "volume": 0}
-            
-        rmin, rmax = np.where(rows)[0][[0, -1]]
-        cmin, cmax = np.where(cols)[0][[0, -1]]
-        
-        # Heuristic scaling: Assuming standard 640x640 frame at 30cm distance
-        # 1 pixel ≈ 0.04 cm
-        pixel_to_cm = 0.04 
-        
-        length = round((rmax - rmin) * pixel_to_cm, 1)
-        width = round((cmax - cmin) * pixel_to_cm, 1)
-        
-        # Depth Estimation: Assuming depth is proportional to the square root 
-        # of the area (shallow wounds usually have smaller depth relative to area)
-        area_pixels = np.sum(mask)
-        area_cm2 = round(area_pixels * (pixel_to_cm ** 2), 1)
-        
+        return self.calculate_dimensions_batch([mask], pixel_to_cm=pixel_to_cm)[0]
+
+    def calculate_dimensions_batch(self, masks, pixel_to_cm=None):
+        """
+        Measures a stacked (N, H, W) mask array (or a list of masks) in one pass.
+        Each separate wound region gets its own area, oriented length/width
+        (principal axes), perimeter, depth and volume under "regions" (largest
+        first); the top-level keys keep the single-wound shape: length/width/depth
+        of the largest region, area/volume/perimeter summed over regions.
+        """
+        if len(masks) == 0:
+            return []
+        if not isinstance(masks, np.ndarray) and len({np.shape(mask) for mask in masks}) > 1:
+            return [self.calculate_dimensions_batch([mask], pixel_to_cm)[0] for mask in masks]
+
+        stack = np.asarray(masks).astype(bool)
+        scale = pixel_to_cm or self.pixel_to_cm
+        regions = self._measure_regions(stack, scale)
+
+        results = []
+        for mask_regions in regions:
+            if not mask_regions:
+                results.append({**EMPTY_MEASUREMENTS, "regions": []})
+                continue
+            largest = mask_regions[0]
+            results.append({
+                "length": largest["length"],
+                "width": largest["width"],
+                "depth": largest["depth"],
+                "area": round(sum(r["area"] for r in mask_regions), 1),
+                "volume": round(sum(r["volume"] for r in mask_regions), 1),
+                "perimeter": round(sum(r["perimeter"] for r in mask_regions), 1),
+                "region_count": len(mask_regions),
+                "regions": mask_regions
+            })
+        return results
+
+    def _measure_regions(self, stack, scale):
+        """
+        Per-region statistics, computed on horizontal pixel runs rather than pixels:
+        every moment, extent and boundary term has a closed form per run.
+        """
+        n, h, w = stack.shape
+        per_mask = [[] for _ in range(n)]
+        row, start, end = find_runs(stack)
+        if row.size == 0:
+            return per_mask
+
+        upper, lower, shared = link_runs(row, start, end, h, w)
+        parent = label_runs(row.size, upper, lower)
+        # Roots are their own parent; number them in order to get dense region IDs
+        is_root = parent == np.arange(row.size)
+        region = (np.cumsum(is_root) - 1)[parent]
+        regions = int(is_root.sum())
+
+        length = (end - start + 1).astype(float)
+        count = np.bincount(region, length, minlength=regions)
+        keep = count >= self.min_region_px
+        if not keep.any():
+            return per_mask
+
+        # Raw moments per run: x runs start..end on a fixed y
+        y = (row % h).astype(float)
+        x0, x1 = start.astype(float), end.astype(float)
+        sum_x = length * (x0 + x1) / 2
+        sum_xx = (x1 * (x1 + 1) * (2 * x1 + 1) - (x0 - 1) * x0 * (2 * x0 - 1)) / 6
+
+        # Centroid and second central moments per region → principal axis angle
+        cx = np.bincount(region, sum_x, minlength=regions) / count
+        cy = np.bincount(region, length * y, minlength=regions) / count
+        cov_xx = np.bincount(region, sum_xx, minlength=regions) / count - cx ** 2
+        cov_yy = np.bincount(region, length * y * y, minlength=regions) / count - cy ** 2
+        cov_xy = np.bincount(region, sum_x * y, minlength=regions) / count - cx * cy
+        theta = 0.5 * np.arctan2(2 * cov_xy, cov_xx - cov_yy)
+
+        # Extents along the principal axes (oriented length and width); the
+        # projection is linear along a run, so its endpoints bound it
+        cos, sin = np.cos(theta)[region], np.sin(theta)[region]
+        dy = y - cy[region]
+        extents = []
+        for x_axis, y_axis in ((cos, sin), (-sin, cos)):
+            high = np.full(regions, -np.inf)
+            low = np.full(regions, np.inf)
+            for x in (x0, x1):
+                proj = (x - cx[region]) * x_axis + dy * y_axis
+                np.maximum.at(high, region, proj)
+                np.minimum.at(low, region, proj)
+            extents.append(high - low + 1)
+        major = np.maximum(*extents) * scale
+        minor = np.minimum(*extents) * scale
+
+        # Perimeter: pixel edges facing background or the frame border (two run ends plus
+        # the top/bottom edges not shared with a touching run), with a pixel whose two
+        # adjacent sides are open counted as one diagonal step (√2) instead of two edges
+        open_edges = 2 + 2 * length
+        np.subtract.at(open_edges, upper, shared)
+        np.subtract.at(open_edges, lower, shared)
+        top, bottom = (row % h) == 0, (row % h) == h - 1
+        open_vertical = []
+        for col in (start, end):
+            open_up = top | ~_covered(row, start, end, row - 1, col, w)
+            open_down = bottom | ~_covered(row, start, end, row + 1, col, w)
+            open_vertical.append(open_up | open_down)
+        single = length == 1
+        corners = open_vertical[0].astype(float) + np.where(single, 0, open_vertical[1])
+        perimeter = np.bincount(region, open_edges - corners * (2 - SQRT2), minlength=regions) * scale
+
+        area = count * scale ** 2
         # Basic heuristic for depth (0.2 to 2.0 cm based on area)
-        depth_cm = round(max(0.2, min(2.0, np.sqrt(area_cm2) * 0.15)), 1)
-        
-        volume_cm3 = round(area_cm2 * depth_cm * 0.7, 1) # 0.7 is a shape factor for ellipsoid-like wounds
-        
-        return {
-            "length": length,
-            "width": width,
-            "depth": depth_cm,
-            "area": area_cm2,
-            "volume": volume_cm3
-        }
+        depth = np.clip(np.sqrt(area) * 0.15, 0.2, 2.0)
+        volume = area * np.round(depth, 1) * 0.7 # 0.7 is a shape factor for ellipsoid-like wounds
+
+        mask_of = row[is_root] // h
+        for i in np.flatnonzero(keep)[np.argsort(-count[keep], kind="stable")].tolist():
+            per_mask[int(mask_of[i])].append({
+                "area": round(float(area[i]), 1),
+                "length": round(float(major[i]), 1),
+                "width": round(float(minor[i]), 1),
+                "perimeter": round(float(perimeter[i]), 1),
+                "depth": round(float(depth[i]), 1),
+                "volume": round(float(volume[i]), 1),
+                "orientation_deg": round(float(np.degrees(theta[i])), 1),
+                "centroid_px": [round(float(cx[i]), 1), round(float(cy[i]), 1)]
+            })
+        return per_mask
@@ -1,12 +1,10 @@
+import asyncio
+import hashlib
 from app.groq_client import GroqService
+from app.research_cache import research_cache, measurement_signature
 
-class ResearchAgent:
-    def research_wound_protocols(self, diagnosis_summary):
-        """
-        Research agent that integrates latest 2025-2026 clinical protocols.
-        """
-        # Latest Protocol Context (Scraped/Searched info)
-        protocol_context = """
+# Latest Protocol Context (Scraped/Searched info)
+PROTOCOL_CONTEXT = """
         Wagner Grade 2 Protocols (2025-2026):
         - Sharp Debridement: Preferred method to remove necrotic tissue and callus.
         - Infection Control: recognized by signs like erythema/purulence. Empiric oral antibiotics for mild; parenteral for moderate/severe.
@@ -14,11 +12,28 @@ class ResearchAgent:
         - Environment: Moist wound healing dressings (non-sucrose-octasulfate for non-infected).
         - Vascular: Revascularization if ABI < 0.5 or pulses absent.
         """
-        
+
+# Cached insights are tied to the protocol text they were synthesized from
+PROTOCOL_VERSION = hashlib.sha1(PROTOCOL_CONTEXT.encode()).hexdigest()[:8]
+
+class ResearchAgent:
+    async def research_wound_protocols(self, measurements: dict):
+        """
+        Research agent that integrates latest 2025-2026 clinical protocols.
+        The only varying input is the wound's size class, so insights are memoized
+        per quantized measurement signature.
+        """
+        signature = measurement_signature(measurements)
+        cache_key = f"{signature}|{PROTOCOL_VERSION}"
+        # The cache is SQLite-backed: keep its reads and writes off the event loop
+        cached = await asyncio.to_thread(research_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
         prompt = f"""
-        Given the clinical data: {diagnosis_summary}
+        Given the clinical data: wound {signature}
         
-        Using these latest protocols: {protocol_context}
+        Using these latest protocols: {PROTOCOL_CONTEXT}
         
         Synthesize a Research Insight summary for the MD:
         1. Priority protocol matches (e.g. need for offloading).
@@ -28,5 +43,6 @@ class ResearchAgent:
         Provide high-end, surgical-grade insights.
         """
         
-        research_data = GroqService.get_mixtral_recommendation(prompt)
+        research_data = await GroqService.get_mixtral_recommendation(prompt)
+        await asyncio.to_thread(research_cache.set, cache_key, research_data)
         return research_data
@@ -1,57 +1,228 @@
-# import torch
-import numpy as np
 import os
-# from PIL import Image
-# from ultralytics import YOLO   # ❌ YOLO disabled
+import numpy as np
 
-class SegmentationAgent:
-    def __init__(self, model_path="C:/Users/hp/Desktop/wound_analysis/backend/weight/yolo26s-seg.pt"):
-        # Adjusting to handle both local and absolute path provided by user
-        if not os.path.isabs(model_path):
-            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            self.model_path = os.path.join(base_dir, model_path)
+# Which segmenter to load: "color" (pure CPU, no model file), "onnx" or "yolo"
+SEGMENTATION_BACKEND = os.environ.get("SEGMENTATION_BACKEND", "color")
+SEGMENTATION_MODEL_PATH = os.environ.get("SEGMENTATION_MODEL_PATH", "weight/yolo26s-seg.pt")
+
+# Frame size the measurement calibration (PIXEL_TO_CM) assumes
+FRAME_SIZE = 640
+# Neutral gray padding of non-square photos: no saturation and too bright for necrosis
+LETTERBOX_FILL = 114
+
+# A "wound" covering less/more of the frame than this is treated as a miss
+MIN_WOUND_FRACTION = 0.002
+MAX_WOUND_FRACTION = 0.6
+
+
+def load_rgb(image_path, size=FRAME_SIZE):
+    """
+    Decodes an image file to a (size, size, 3) uint8 RGB array, letterboxed: scaled by
+    its longest side and centred on LETTERBOX_FILL padding. A pixel then spans the same
+    distance along both axes, which the single PIXEL_TO_CM of MeasurementAgent assumes.
+    """
+    from PIL import Image, ImageOps
+    with Image.open(image_path) as img:
+        return np.asarray(ImageOps.pad(img.convert("RGB"), (size, size), color=(LETTERBOX_FILL,) * 3))
+
+
+def _hsv(rgb):
+    from PIL import Image
+    hsv = np.asarray(Image.fromarray(rgb).convert("HSV")).astype(np.int16)
+    return hsv[..., 0], hsv[..., 1], hsv[..., 2]
+
+
+def tissue_masks(rgb):
+    """
+    Classical color rules for wound bed tissue (PIL HSV, all channels 0-255):
+    red/pink granulation, yellow slough, and dark necrotic (eschar) tissue.
+    """
+    h, s, v = _hsv(rgb)
+    granulation = ((h <= 12) | (h >= 235)) & (s >= 110) & (v >= 70)
+    slough = (h >= 20) & (h <= 45) & (s >= 100) & (v >= 110)
+    necrosis = (v <= 45)
+    return granulation, slough, necrosis
+
+
+def tissue_composition(rgb, mask):
+    """Percentage of granulation / slough / necrosis pixels inside the wound mask."""
+    mask = mask.astype(bool)
+    total = mask.sum()
+    if not total:
+        return {"granulation": 0.0, "slough": 0.0, "necrosis": 0.0}
+    granulation, slough, necrosis = tissue_masks(rgb)
+    counts = {
+        "granulation": (granulation & mask).sum(),
+        "slough": (slough & mask & ~granulation).sum(),
+        "necrosis": (necrosis & mask & ~granulation & ~slough).sum(),
+    }
+    return {name: round(float(count) / total * 100, 1) for name, count in counts.items()}
+
+
+def _close(mask, steps=2):
+    """Binary closing (dilate then erode) with a 3x3 cross, via array shifts."""
+    def dilate(m):
+        out = m.copy()
+        out[1:] |= m[:-1]; out[:-1] |= m[1:]
+        out[:, 1:] |= m[:, :-1]; out[:, :-1] |= m[:, 1:]
+        return out
+
+    def erode(m):
+        return ~dilate(~m)
+
+    for _ in range(steps):
+        mask = dilate(mask)
+    for _ in range(steps):
+        mask = erode(mask)
+    return mask
+
+
+def _result(mask, rgb):
+    fraction = mask.mean()
+    detected = bool(MIN_WOUND_FRACTION <= fraction <= MAX_WOUND_FRACTION)
+    return {
+        "mask": mask.astype(np.uint8),
+        "detected": detected,
+        "tissue": tissue_composition(rgb, mask) if detected else None,
+    }
+
+
+class ColorThresholdBackend:
+    """
+    Pure-CPU classical segmenter: wound bed = saturated red/yellow tissue, plus dark
+    necrotic pixels lying inside that region's bounding box, cleaned by a closing.
+    Needs only NumPy and Pillow.
+    """
+    name = "color"
+
+    def load(self):
+        import PIL  # noqa: F401  (fail at startup, not on the first scan)
+
+    def segment_batch(self, image_paths):
+        results = []
+        for path in image_paths:
+            rgb = load_rgb(path)
+            granulation, slough, necrosis = tissue_masks(rgb)
+            mask = granulation | slough
+            if mask.any():
+                rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+                box = np.zeros_like(mask)
+                box[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1] = True
+                mask |= necrosis & box
+            results.append(_result(_close(mask), rgb))
+        return results
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime semantic segmenter (CPU). Expects a model taking float32 NCHW RGB
+    in [0, 1] at FRAME_SIZE and returning wound probabilities shaped (N, 1, H, W)
+    or (N, H, W). Images are run as one batch when the model's batch axis is dynamic.
+    """
+    name = "onnx"
+
+    def __init__(self, model_path=SEGMENTATION_MODEL_PATH):
+        self.model_path = model_path
+        self.session = None
+
+    def load(self):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.dynamic_batch = not isinstance(batch_dim, int)
+
+    def segment_batch(self, image_paths):
+        images = [load_rgb(path) for path in image_paths]
+        tensor = np.stack(images).transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+        if self.dynamic_batch:
+            probs = self.session.run(None, {self.input_name: tensor})[0]
         else:
-            self.model_path = model_path
-            
+            probs = np.concatenate([self.session.run(None, {self.input_name: t[None]})[0] for t in tensor])
+        probs = probs.reshape(len(images), *probs.shape[-2:])
+        return [_result(p > 0.5, rgb) for p, rgb in zip(probs, images)]
+
+
+class YoloBackend:
+    """Ultralytics YOLO instance segmentation; all detected instances form the wound mask."""
+    name = "yolo"
+
+    def __init__(self, model_path=SEGMENTATION_MODEL_PATH):
+        self.model_path = model_path
         self.model = None
 
-        # ❌ YOLO model loading disabled
-        # try:
-        #     if os.path.exists(self.model_path):
-        #         self.model = YOLO(self.model_path)
-        #         print(f"--- YOLO Model loaded from {self.model_path} ---")
-        #     else:
-        #         print(f"--- WARNING: Model not found at {self.model_path} ---")
-        # except Exception as e:
-        #     print(f"Error loading model: {e}")
+    def load(self):
+        from ultralytics import YOLO
+        self.model = YOLO(self.model_path)
+
+    def segment_batch(self, image_paths):
+        # Predict on the letterboxed frames (BGR, as Ultralytics expects for arrays) so the
+        # masks come back in the same geometry as the other backends'
+        images = [load_rgb(path) for path in image_paths]
+        results = []
+        for rgb, prediction in zip(images, self.model([rgb[..., ::-1] for rgb in images], imgsz=FRAME_SIZE, verbose=False)):
+            if prediction.masks is None:
+                results.append(_result(np.zeros((FRAME_SIZE, FRAME_SIZE), dtype=bool), rgb))
+                continue
+            mask = (prediction.masks.data.cpu().numpy() > 0.5).any(axis=0)
+            if mask.shape != (FRAME_SIZE, FRAME_SIZE):
+                from PIL import Image
+                mask = np.asarray(Image.fromarray(mask).resize((FRAME_SIZE, FRAME_SIZE)))
+            results.append(_result(mask, rgb))
+        return results
 
-        print("--- YOLO Disabled: Running in dummy segmentation mode ---")
+
+BACKENDS = {
+    ColorThresholdBackend.name: ColorThresholdBackend,
+    OnnxBackend.name: OnnxBackend,
+    YoloBackend.name: YoloBackend,
+}
+
+
+class SegmentationAgent:
+    def __init__(self, backend=SEGMENTATION_BACKEND, model_path=SEGMENTATION_MODEL_PATH):
+        # Model paths are resolved relative to the backend/ directory
+        if not os.path.isabs(model_path):
+            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            model_path = os.path.join(base_dir, model_path)
+
+        backend_cls = BACKENDS.get(backend)
+        if backend_cls is None:
+            raise ValueError(f"Unknown SEGMENTATION_BACKEND '{backend}' (choose from {', '.join(BACKENDS)})")
+        self.backend = backend_cls() if backend_cls is ColorThresholdBackend else backend_cls(model_path)
+
+        try:
+            self.backend.load()
+            print(f"--- Segmentation backend '{self.backend.name}' loaded ---")
+        except Exception as e:
+            print(f"--- WARNING: segmentation backend '{backend}' unavailable ({e}); every scan falls back to vision ---")
+            self.backend = None
 
     def segment(self, image_path):
         """
-        Dummy segmentation function (YOLO disabled).
-        Always returns a white mask and detection_success=False.
+        Segments one image. Returns (mask, detection_success); see segment_batch
+        for the tissue composition.
+        """
+        result = self.segment_batch([image_path])[0]
+        return result["mask"], result["detected"]
+
+    def segment_batch(self, image_paths):
+        """
+        Segments several images in one backend call. Returns one dict per image:
+        {"mask": uint8 (640, 640) in the letterboxed frame, "detected": bool, "tissue": {...} or None}.
+        An unreadable image or a failed backend yields detected=False.
         """
+        image_paths = list(image_paths)
+        if self.backend is not None:
+            try:
+                return self.backend.segment_batch(image_paths)
+            except Exception as e:
+                if len(image_paths) > 1:
+                    # Isolate the bad image instead of failing the whole batch
+                    return [self.segment_batch([path])[0] for path in image_paths]
+                print(f"Segmentation error: {e}")
 
-        # ❌ YOLO inference disabled
-        # if self.model is None:
-        #     print("--- Using dummy mask (Model not loaded) ---")
-        #     return np.ones((640, 640), dtype=np.uint8), False
-
-        # try:
-        #     results = self.model(image_path)
-        #     result = results[0]
-        #     
-        #     if result.masks is not None:
-        #         mask = result.masks.data[0].cpu().numpy()
-        #         mask = (mask > 0.5).astype(np.uint8)
-        #         return mask, True
-        #     else:
-        #         print("--- No wound detected by YOLO ---")
-        #         return np.zeros((640, 640), dtype=np.uint8), False
-        # except Exception as e:
-        #     print(f"Segmentation error: {e}")
-        #     return np.zeros((640, 640), dtype=np.uint8), False
-
-        print("--- Returning dummy mask (YOLO not available) ---")
-        return np.ones((640, 640), dtype=np.uint8), False
\ No newline at end of file
+        return [
+            {"mask": np.zeros((FRAME_SIZE, FRAME_SIZE), dtype=np.uint8), "detected": False, "tissue": None}
+            for _ in image_paths
+        ]
@@ -1,15 +1,28 @@
+import time
+import inspect
+import functools
 from typing import TypedDict, Annotated
-from langgraph.graph import StateGraph, END
-from app.agents.segmentation_agent import SegmentationAgent
+from langgraph.graph import StateGraph, START, END
+from langgraph.config import get_stream_writer
 from app.agents.measurement_agent import MeasurementAgent
 from app.agents.diagnosis_agent import DiagnosisAgent
 from app.agents.research_agent import ResearchAgent
-from app.csv_store import log_assessment
+from app.assessments_store import log_assessment
+from app.mask_store import save_mask
 from app.groq_client import GroqService
+from app.segmentation_service import segmentation_service
+
+# Bump whenever prompts, models or node logic change so cached results are not reused
+PIPELINE_VERSION = "5.5"
+
+def merge_timings(current: dict, update: dict) -> dict:
+    """Reducer so parallel branches can each report their own node timings."""
+    return {**(current or {}), **(update or {})}
 
 # Define the state for the graph
 class AgentState(TypedDict):
     image_path: str
+    analysis_image_path: str
     patient_data: dict
     doctor_id: str
     mask: Annotated[object, "Wound mask array"]
@@ -19,82 +32,188 @@ class AgentState(TypedDict):
     research: str
     status: str
     detection_success: bool
+    timings: Annotated[dict, merge_timings]
+    stream_tokens: bool
+    mask_assessment_id: int
+    job_id: str
+
+# Keys the measurement branch hands back to the main graph at the join
+class MeasurementBranchOutput(TypedDict):
+    measurements: dict
+    research: str
+    timings: Annotated[dict, merge_timings]
+
+# Used when segmentation finds no wound
+FALLBACK_MEASUREMENTS = {"length": 1, "width": 1, "depth": 0.5, "area": 0.1, "volume": 0.05}
 
 # Initialize agents
-seg_agent = SegmentationAgent()
 meas_agent = MeasurementAgent()
 diag_agent = DiagnosisAgent()
 res_agent = ResearchAgent()
 
+def timed(name):
+    """Records the wall time of a node (seconds) under state['timings'][name]."""
+    def decorator(node):
+        if inspect.iscoroutinefunction(node):
+            @functools.wraps(node)
+            async def async_wrapper(state):
+                start = time.perf_counter()
+                update = await node(state)
+                update["timings"] = {name: round(time.perf_counter() - start, 3)}
+                return update
+            return async_wrapper
+
+        @functools.wraps(node)
+        def wrapper(state):
+            start = time.perf_counter()
+            update = node(state)
+            update["timings"] = {name: round(time.perf_counter() - start, 3)}
+            return update
+        return wrapper
+    return decorator
+
 # Define nodes
-def segmentation_node(state: AgentState):
+def local_tissue_caption(tissue):
+    """Caption built from the segmenter's tissue colour analysis (replaces the vision call)."""
+    return (
+        "Local segmentation analysis of the wound bed (colour-based tissue classification): "
+        f"Granulation ~{tissue['granulation']}%, Slough ~{tissue['slough']}%, "
+        f"Necrotic tissue ~{tissue['necrosis']}%. Periwound condition and exudate were not "
+        "assessed visually; infer them from the measurements and protocol context."
+    )
+
+@timed("segmentation")
+async def segmentation_node(state: AgentState):
     print("---NODE: SEGMENTATION---")
-    mask, success = seg_agent.segment(state['image_path'])
-    
-    caption = ""
-    if not success:
-        caption = GroqService.get_llama_vision_analysis(state['image_path'])
-    
-    return {"mask": mask, "detection_success": success, "caption": caption, "status": "segmented"}
+    # Runs on the warm segmentation worker pool, micro-batched with concurrent scans
+    result = await segmentation_service.segment(state['analysis_image_path'])
+    update = {"mask": result["mask"], "detection_success": result["detected"], "status": "segmented"}
+    if result["detected"]:
+        update["caption"] = local_tissue_caption(result["tissue"])
+    return update
 
+def route_after_segmentation(state: AgentState):
+    # A local mask already gives tissue composition: only misses pay for the vision LLM
+    if state.get('detection_success'):
+        return ["measurement_branch"]
+    return ["vision", "measurement_branch"]
+
+@timed("vision")
+async def vision_node(state: AgentState):
+    print("---NODE: VISION---")
+    # Fallback when local segmentation finds no wound; runs concurrently with the measurement branch
+    caption = await GroqService.get_llama_vision_analysis(state['analysis_image_path'])
+    return {"caption": caption}
+
+@timed("measurement")
 def measurement_node(state: AgentState):
     print("---NODE: MEASUREMENT---")
     # Even if YOLO fails, we should attempt basic measurement estimation from vision context
     # if we have calibration data. For now, fallback to zeros if no mask.
     if not state.get('detection_success', False):
         # We can simulate minimal data if we have a vision caption indicating a wound
-        return {"measurements": {"length": 1, "width": 1, "depth": 0.5, "area": 0.1, "volume": 0.05}, "status": "measured"}
-        
+        return {"measurements": dict(FALLBACK_MEASUREMENTS), "status": "measured"}
+
     measurements = meas_agent.calculate_dimensions(state['mask'])
     return {"measurements": measurements, "status": "measured"}
 
-def research_node(state: AgentState):
+@timed("research")
+async def research_node(state: AgentState):
     print("---NODE: RESEARCH---")
-    # Simple research based on measurements or visual cues
-    research_summary = res_agent.research_wound_protocols(str(state['measurements']))
+    # Research depends only on the wound's size class (memoized per measurement bucket)
+    research_summary = await res_agent.research_wound_protocols(state['measurements'])
     return {"research": research_summary, "status": "researched"}
 
-def diagnosis_node(state: AgentState):
-    print("---NODE: DIAGNOSIS & LOGGING---")
+@timed("diagnosis")
+async def diagnosis_node(state: AgentState):
+    print("---NODE: DIAGNOSIS---")
     # Use Combined intelligence: Measurements + Vision + Research
     combined_context = f"{state['caption']}\nResearch Protocol Info: {state['research'][:500]}"
-    diagnosis = diag_agent.generate_report(state['measurements'], combined_context)
-    
-    # Persistent Logging to CSV — include image_path for history display
+
+    # Streaming runs (stream_mode="custom") forward each report token as it arrives
+    on_token = None
+    if state.get('stream_tokens'):
+        writer = get_stream_writer()
+        on_token = lambda token: writer({"token": token})
+    diagnosis = await diag_agent.generate_report(state['measurements'], combined_context, on_token=on_token)
+
+    return {"diagnosis": diagnosis, "status": "diagnosed"}
+
+def assessment_record(state):
+    """log_assessment() keyword arguments for a finished pipeline state."""
+    # Persistent Logging to SQLite — include image_path for history display
     image_path = state.get('image_path', '')
     # Convert absolute path to relative URL for frontend access
     image_url = None
     if image_path:
-        import os
         # e.g. "static/uploads/filename.jpg" → "/static/uploads/filename.jpg"
         parts = image_path.replace("\\", "/").split("static/")
         if len(parts) > 1:
             image_url = f"/static/{parts[-1]}"
-    
-    log_assessment(
-        state.get('patient_data', {}),
-        state['measurements'],
-        diagnosis,
-        doctor_id=state.get('doctor_id'),
-        image_url=image_url
-    )
-    
-    return {"diagnosis": diagnosis, "status": "completed"}
 
+    return {
+        "patient_data": state.get('patient_data', {}),
+        "measurements": state['measurements'],
+        "diagnosis": state['diagnosis'],
+        "doctor_id": state.get('doctor_id'),
+        "image_url": image_url,
+        "research": state.get('research'),
+        # Queued analyses log idempotently per job (see JobQueue.start)
+        "job_id": state.get('job_id'),
+    }
+
+
+def store_mask(assessment_id, state):
+    # Keeps the segmentation for re-measuring later; losing it must not fail the scan
+    try:
+        return save_mask(assessment_id, state.get("doctor_id"), state["mask"])
+    except Exception as e:
+        print(f"Mask store error for assessment #{assessment_id}: {e}")
+        return False
+
+
+@timed("persist")
+def persist_node(state: AgentState):
+    print("---NODE: LOGGING---")
+    # Kept apart from diagnosis so batch uploads can write many assessments in one transaction
+    assessment_id = log_assessment(**assessment_record(state))
+    if state.get("detection_success") and store_mask(assessment_id, state):
+        # Cached with the result, so re-uploads of this photo get the same mask
+        return {"status": "completed", "mask_assessment_id": assessment_id}
+    return {"status": "completed"}
+
+
+# Measurement branch: measurement → research.
+# Compiled as a single node so it runs in the same superstep as the vision call.
+branch_builder = StateGraph(AgentState, output_schema=MeasurementBranchOutput)
+
+branch_builder.add_node("measurement", measurement_node)
+branch_builder.add_node("research", research_node)
+
+branch_builder.add_edge(START, "measurement")
+branch_builder.add_edge("measurement", "research")
+branch_builder.add_edge("research", END)
+
+measurement_branch = branch_builder.compile()
 
-# Build the graph
+# Build the graph: segmentation, then the measurement branch (plus vision only when
+# no wound was segmented), join before diagnosis, then persist
 builder = StateGraph(AgentState)
 
 builder.add_node("segmentation", segmentation_node)
-builder.add_node("measurement", measurement_node)
-builder.add_node("research", research_node)
+builder.add_node("vision", vision_node)
+builder.add_node("measurement_branch", measurement_branch)
 builder.add_node("diagnosis", diagnosis_node)
+builder.add_node("persist", persist_node)
 
-builder.set_entry_point("segmentation")
-builder.add_edge("segmentation", "measurement")
-builder.add_edge("measurement", "research")
-builder.add_edge("research", "diagnosis")
-builder.add_edge("diagnosis", END)
+builder.add_edge(START, "segmentation")
+builder.add_conditional_edges("segmentation", route_after_segmentation, ["vision", "measurement_branch"])
+# Both finish in the same superstep, so diagnosis runs once either way
+builder.add_edge("vision", "diagnosis")
+builder.add_edge("measurement_branch", "diagnosis")
+builder.add_edge("diagnosis", "persist")
+builder.add_edge("persist", END)
 
-# Compile
+# Compile (run with `await app_workflow.ainvoke(...)`: the LLM nodes are async;
+# segmentation runs in its process pool and measurement in LangGraph's executor)
 app_workflow = builder.compile()
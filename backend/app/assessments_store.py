@@ -0,0 +1,394 @@
+import base64
+import csv
+import os
+import re
+import sqlite3
+import datetime
+from app.db import get_connection
+from app.report_classifier import classify_report, CLASSIFICATION_COLUMNS
+
+# Legacy flat-file log, kept only as an import source for import_csv_history()
+CSV_PATH = "static/assessments_history.csv"
+
+BASE_COLUMNS = (
+    "timestamp", "patient_id", "patient_name", "doctor_id",
+    "length_cm", "width_cm", "depth_cm", "area_cm2", "volume_cm3",
+    "diagnosis", "image_url", "research",
+)
+INSERT_COLUMNS = BASE_COLUMNS + CLASSIFICATION_COLUMNS
+INSERT_SQL = f'''
+    INSERT INTO assessments ({", ".join(INSERT_COLUMNS)})
+    VALUES ({", ".join("?" for _ in INSERT_COLUMNS)})
+'''
+
+def _with_classification(base_row):
+    """Appends the ingest-time classification of the row's diagnosis (index 9)."""
+    classification = classify_report(base_row[9])
+    return tuple(base_row) + tuple(classification[col] for col in CLASSIFICATION_COLUMNS), classification
+
+def _assessment_row(patient_data, measurements, diagnosis, doctor_id, image_url=None, research=None):
+    m = measurements
+    return (
+        datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        str(patient_data.get("id", "N/A")).strip(),
+        patient_data.get("name", "N/A"),
+        str(doctor_id).strip() if doctor_id else None,
+        m.get("length", 0),
+        m.get("width",  0),
+        m.get("depth",  0),
+        m.get("area",   0),
+        m.get("volume", 0),
+        # IMPORTANT: preserve newlines so structured ### SECTIONS are rendered by the frontend
+        (diagnosis or "").strip(),
+        image_url or "",
+        research or "",
+    )
+
+
+def log_assessment(patient_data, measurements, diagnosis, doctor_id, image_url=None, research=None, job_id=None):
+    """
+    Persists assessment data to the SQLite assessments table for auditing.
+    Diagnosis newlines are preserved so structured sections survive round-trips;
+    the diagnosis and research text are full-text indexed by a trigger on insert.
+    Returns the new assessment ID. With a `job_id`, logging is idempotent: a job
+    resumed after a crash gets back the assessment it already logged.
+    """
+    return log_assessments([{
+        "patient_data": patient_data,
+        "measurements": measurements,
+        "diagnosis": diagnosis,
+        "doctor_id": doctor_id,
+        "image_url": image_url,
+        "research": research,
+        "job_id": job_id,
+    }])[0]
+
+
+def log_assessments(records):
+    """
+    Persists several assessments (log_assessment keyword dicts) in one transaction,
+    e.g. all wounds photographed during one visit. Returns the new IDs in order.
+    """
+    # Classify once at ingest so reads filter on typed, indexed columns
+    rows = [
+        _with_classification(_assessment_row(**{key: value for key, value in record.items() if key != "job_id"}))
+        for record in records
+    ]
+
+    assessment_ids = []
+    with get_connection() as conn:
+        for record, (row, classification) in zip(records, rows):
+            job_id = record.get("job_id")
+            if job_id:
+                existing = conn.execute('SELECT id FROM assessments WHERE job_id = ?', (job_id,)).fetchone()
+                if existing:
+                    print(f"---ASSESSMENT #{existing[0]} ALREADY LOGGED FOR {job_id}---")
+                    assessment_ids.append(existing[0])
+                    continue
+            assessment_id = conn.execute(INSERT_SQL, row).lastrowid
+            if job_id:
+                conn.execute('UPDATE assessments SET job_id = ? WHERE id = ?', (job_id, assessment_id))
+            assessment_ids.append(assessment_id)
+            # Dashboard aggregates are updated in the same transaction as the insert
+            _bump_aggregates(conn, row[3], row[0][:10], classification["is_alert"], classification["wagner_grade"])
+
+    for assessment_id in assessment_ids:
+        print(f"---LOGGED ASSESSMENT #{assessment_id} TO SQLITE---")
+    return assessment_ids
+
+
+# Columns a history client may project with `fields=`; id and timestamp are always returned (cursor keys)
+HISTORY_FIELDS = ("id",) + INSERT_COLUMNS
+
+
+def encode_cursor(row):
+    """Opaque keyset cursor pointing just past `row` in (timestamp DESC, id DESC) order."""
+    return base64.urlsafe_b64encode(f"{row['timestamp']}|{row['id']}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (timestamp, id) from a cursor, or raises ValueError if it is malformed."""
+    try:
+        timestamp, assessment_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return timestamp, int(assessment_id)
+    except Exception:
+        raise ValueError(f"Invalid history cursor: {cursor!r}")
+
+
+def _project(fields):
+    if not fields:
+        return "*"
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown history fields: {', '.join(unknown)}")
+    columns = ["id", "timestamp"] + [f for f in fields if f not in ("id", "timestamp")]
+    return ", ".join(dict.fromkeys(columns))
+
+
+def get_assessments(doctor_id=None, patient_id=None, since=None, alerts_only=False, wagner_grade=None,
+                    until=None, fields=None, limit=None, cursor=None):
+    """
+    Reads assessment history, newest first.
+    Doctor matching is case-insensitive (the column is declared COLLATE NOCASE),
+    and all filtering runs inside SQLite on the (doctor_id, timestamp),
+    (patient_id, timestamp), alert and grade indexes.
+
+    `fields` projects a subset of HISTORY_FIELDS (e.g. leave out `diagnosis` for
+    list views). `since`/`until` are inclusive timestamps or YYYY-MM-DD dates. With `limit`, at most that many rows are read, starting after
+    `cursor` (keyset pagination on timestamp + id, stable under concurrent inserts).
+    """
+    clauses, params = [], []
+    if alerts_only:
+        clauses.append("is_alert = 1")
+    if wagner_grade is not None:
+        clauses.append("wagner_grade = ?")
+        params.append(int(wagner_grade))
+    if doctor_id:
+        clauses.append("doctor_id = ?")
+        params.append(str(doctor_id).strip())
+    if patient_id:
+        clauses.append("patient_id = ?")
+        params.append(str(patient_id).strip())
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        # A bare date means "through the end of that day", not midnight at its start
+        clauses.append("timestamp < date(?, '+1 day')" if len(until) == 10 else "timestamp <= ?")
+        params.append(until)
+    if cursor:
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        clauses.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+        params.extend([cursor_ts, cursor_ts, cursor_id])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    page = ""
+    if limit is not None:
+        page = "LIMIT ?"
+        params.append(int(limit))
+
+    with get_connection() as conn:
+        rows = conn.execute(
+            f'SELECT {_project(fields)} FROM assessments {where} ORDER BY timestamp DESC, id DESC {page}', params
+        ).fetchall()
+
+    return [dict(row) for row in rows]
+
+
+def get_assessment(assessment_id, doctor_id=None):
+    """One assessment row as a dict, or None (also when it belongs to another doctor)."""
+    sql, params = "SELECT * FROM assessments WHERE id = ?", [assessment_id]
+    if doctor_id:
+        sql += " AND doctor_id = ?"
+        params.append(str(doctor_id).strip())
+    with get_connection() as conn:
+        row = conn.execute(sql, params).fetchone()
+    return dict(row) if row else None
+
+
+# Rows shown per search hit; the full record is fetched through the history API
+SEARCH_COLUMNS = ("id", "timestamp", "patient_id", "patient_name", "wagner_grade", "is_alert", "image_url")
+
+
+def _fts_query(text):
+    """
+    Turns free text into an FTS5 query: every term must match, quoted so clinical
+    input like "post-op" or "high risk" is never parsed as FTS syntax. A trailing
+    `*` on a term keeps its prefix meaning (e.g. "osteo*").
+    """
+    terms = []
+    for term in re.findall(r'[^\s"]+', text or ""):
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search_assessments(query, doctor_id, limit=20):
+    """
+    Ranked full-text search over a doctor's diagnosis and research text.
+    Returns the best matches first (BM25), each with a highlighted `snippet`.
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    columns = ", ".join(f"a.{col}" for col in SEARCH_COLUMNS)
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {columns},
+                       snippet(assessments_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet,
+                       bm25(assessments_fts) AS rank
+                FROM assessments_fts
+                JOIN assessments a ON a.id = assessments_fts.rowid
+                WHERE assessments_fts MATCH ? AND a.doctor_id = ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (match, str(doctor_id).strip(), int(limit))).fetchall()
+    except sqlite3.OperationalError as e:
+        raise ValueError(f"Invalid search query: {e}")
+    return [dict(row) for row in rows]
+
+
+def count_assessments(doctor_id=None, since=None):
+    """
+    Counts assessments for a doctor, optionally only those logged at or after `since`.
+    """
+    clauses, params = [], []
+    if doctor_id:
+        clauses.append("doctor_id = ?")
+        params.append(str(doctor_id).strip())
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    with get_connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM assessments {where}', params).fetchone()[0]
+
+
+def _bump_aggregates(conn, doctor_id, day, alert, grade, scans=1):
+    """
+    Adds scans to the per-doctor dashboard aggregates inside the caller's transaction.
+    A NULL doctor is aggregated under '' so clinic-wide totals still include it.
+    """
+    doctor_key = doctor_id or ""
+    conn.execute('''
+        INSERT INTO doctor_stats (doctor_id, total_scans, alerts, grade_1, grade_2, grade_3)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(doctor_id) DO UPDATE SET
+            total_scans = total_scans + excluded.total_scans,
+            alerts = alerts + excluded.alerts,
+            grade_1 = grade_1 + excluded.grade_1,
+            grade_2 = grade_2 + excluded.grade_2,
+            grade_3 = grade_3 + excluded.grade_3
+    ''', (doctor_key, scans, alert, int(grade == 1) * scans, int(grade == 2) * scans, int(grade == 3) * scans))
+    conn.execute('''
+        INSERT INTO doctor_daily_scans (doctor_id, day, scans) VALUES (?, ?, ?)
+        ON CONFLICT(doctor_id, day) DO UPDATE SET scans = scans + excluded.scans
+    ''', (doctor_key, day, scans))
+
+
+def get_doctor_aggregates(doctor_id=None):
+    """
+    Dashboard totals for a doctor (or the whole clinic when doctor_id is None),
+    read from the incrementally maintained doctor_stats table.
+    """
+    with get_connection() as conn:
+        if doctor_id:
+            row = conn.execute(
+                'SELECT total_scans, alerts, grade_1, grade_2, grade_3 FROM doctor_stats WHERE doctor_id = ?',
+                (str(doctor_id).strip(),)
+            ).fetchone()
+        else:
+            row = conn.execute('''
+                SELECT SUM(total_scans), SUM(alerts), SUM(grade_1), SUM(grade_2), SUM(grade_3) FROM doctor_stats
+            ''').fetchone()
+
+    total_scans, alerts, g1, g2, g3 = [value or 0 for value in row] if row else (0, 0, 0, 0, 0)
+    return {
+        "total_scans": total_scans,
+        "alerts": alerts,
+        "breakdown": {"Grade 1": g1, "Grade 2": g2, "Grade 3": g3},
+    }
+
+
+def count_scans_on(doctor_id, day):
+    """Number of scans a doctor logged on `day` (YYYY-MM-DD)."""
+    with get_connection() as conn:
+        row = conn.execute(
+            'SELECT scans FROM doctor_daily_scans WHERE doctor_id = ? AND day = ?',
+            (str(doctor_id or "").strip(), day)
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def backfill_classifications(batch_size=500):
+    """
+    Classifies historical rows that predate the typed columns, in batches of
+    `batch_size` (one short transaction each). Returns the number of rows updated.
+    """
+    assignments = ", ".join(f"{col} = ?" for col in CLASSIFICATION_COLUMNS)
+    updated = 0
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute(
+                'SELECT id, diagnosis FROM assessments WHERE alert_flags IS NULL LIMIT ?', (batch_size,)
+            ).fetchall()
+            if not rows:
+                return updated
+            batch = []
+            for assessment_id, diagnosis in rows:
+                classification = classify_report(diagnosis)
+                batch.append(tuple(classification[col] for col in CLASSIFICATION_COLUMNS) + (assessment_id,))
+            conn.executemany(f'UPDATE assessments SET {assignments} WHERE id = ?', batch)
+        updated += len(batch)
+
+
+def rebuild_aggregates():
+    """
+    Recomputes doctor_stats and doctor_daily_scans from the raw assessment history
+    in a single transaction, grouping on the typed classification columns.
+    Returns the number of assessments covered.
+    """
+    with get_connection() as conn:
+        conn.execute('DELETE FROM doctor_stats')
+        conn.execute('DELETE FROM doctor_daily_scans')
+        conn.execute('''
+            INSERT INTO doctor_stats (doctor_id, total_scans, alerts, grade_1, grade_2, grade_3)
+            SELECT COALESCE(doctor_id, ''), COUNT(*), COALESCE(SUM(is_alert = 1), 0),
+                   COALESCE(SUM(wagner_grade = 1), 0), COALESCE(SUM(wagner_grade = 2), 0),
+                   COALESCE(SUM(wagner_grade = 3), 0)
+            FROM assessments
+            GROUP BY COALESCE(doctor_id, '') COLLATE NOCASE
+        ''')
+        conn.execute('''
+            INSERT INTO doctor_daily_scans (doctor_id, day, scans)
+            SELECT COALESCE(doctor_id, ''), substr(timestamp, 1, 10), COUNT(*)
+            FROM assessments
+            GROUP BY COALESCE(doctor_id, '') COLLATE NOCASE, substr(timestamp, 1, 10)
+        ''')
+        return conn.execute('SELECT COUNT(*) FROM assessments').fetchone()[0]
+
+
+def import_csv_history(csv_path=CSV_PATH):
+    """
+    One-shot migration of the legacy CSV log into the assessments table.
+    Runs in a single transaction and renames the CSV afterwards so it is never imported twice.
+    Returns the number of imported rows.
+    """
+    if not os.path.isfile(csv_path):
+        return 0
+
+    def _num(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0
+
+    with open(csv_path, mode='r', encoding='utf-8') as f:
+        rows = [
+            (
+                row.get("timestamp"),
+                (row.get("patient_id") or "N/A").strip(),
+                row.get("patient_name") or "N/A",
+                (row.get("doctor_id") or "").strip() or None,
+                _num(row.get("length_cm")),
+                _num(row.get("width_cm")),
+                _num(row.get("depth_cm")),
+                _num(row.get("area_cm2")),
+                _num(row.get("volume_cm3")),
+                (row.get("diagnosis") or "").strip(),
+                row.get("image_url") or "",
+                row.get("research") or "",
+            )
+            for row in csv.DictReader(f)
+        ]
+
+    with get_connection() as conn:
+        conn.executemany(INSERT_SQL, [_with_classification(row)[0] for row in rows])
+
+    rebuild_aggregates()
+    os.replace(csv_path, f"{csv_path}.imported")
+    print(f"---IMPORTED {len(rows)} ASSESSMENTS FROM {csv_path}---")
+    return len(rows)
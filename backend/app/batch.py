@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from app.agents.workflow import (
+    meas_agent, FALLBACK_MEASUREMENTS, local_tissue_caption,
+    vision_node, research_node, diagnosis_node, assessment_record,
+)
+from app.assessments_store import log_assessments
+from app.jobs import build_initial_state, analysis_response, cached_state
+from app.mask_store import save_masks, copy_masks
+from app.result_cache import CACHED_FIELDS, get_cached_result, put_cached_result
+from app.segmentation_service import segmentation_service
+
+# Images of one visit whose LLM stages (vision, research, diagnosis) may run at once
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "20"))
+
+
+async def _measure_all(image_paths):
+    """
+    Segmentation + measurement for every image of the visit: the images share
+    segmentation micro-batches on the worker pool, then all masks are measured
+    in one stacked pass off the event loop.
+    """
+    start = time.perf_counter()
+    segmented = await segmentation_service.segment_batch(image_paths)
+    segment_elapsed = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    detected = [i for i, result in enumerate(segmented) if result["detected"]]
+    masks = [segmented[i]["mask"] for i in detected]
+    measured = dict(zip(detected, await asyncio.to_thread(meas_agent.calculate_dimensions_batch, masks)))
+    measure_elapsed = round(time.perf_counter() - start, 3)
+
+    updates = []
+    for i, result in enumerate(segmented):
+        update = {
+            "mask": result["mask"],
+            "detection_success": result["detected"],
+            "measurements": measured.get(i, dict(FALLBACK_MEASUREMENTS)),
+            "status": "measured",
+            "timings": {"segmentation (batch)": segment_elapsed, "measurement (batch)": measure_elapsed},
+        }
+        if result["detected"]:
+            update["caption"] = local_tissue_caption(result["tissue"])
+        updates.append(update)
+    return updates
+
+
+def _apply(state, update):
+    timings = {**state["timings"], **update.pop("timings", {})}
+    state.update(update)
+    state["timings"] = timings
+
+
+async def _run_llm_stages(state, semaphore):
+    # Same order as the graph: research (∥ vision when nothing was segmented), then diagnosis
+    async with semaphore:
+        stages = [research_node(state)]
+        if not state["detection_success"]:
+            stages.append(vision_node(state))
+        for update in await asyncio.gather(*stages):
+            _apply(state, update)
+        _apply(state, await diagnosis_node(state))
+
+
+def _store_masks(assessment_ids, states):
+    """
+    One append pass for the visit: segmented images store their masks, cache hits
+    reuse the mask of the assessment they were cached from. Records each stored
+    mask's assessment on its state; a failed mask write never fails the assessments.
+    """
+    segmented = [(assessment_id, state) for assessment_id, state in zip(assessment_ids, states)
+                 if state["detection_success"] and state.get("mask") is not None]
+    try:
+        save_masks([(assessment_id, state.get("doctor_id"), state["mask"]) for assessment_id, state in segmented])
+        copy_masks([
+            (state["mask_assessment_id"], assessment_id, state.get("doctor_id"))
+            for assessment_id, state in zip(assessment_ids, states)
+            if state.get("mask") is None and state.get("mask_assessment_id")
+        ])
+    except Exception as e:
+        print(f"Batch mask store failed: {e}")
+        return
+    for assessment_id, state in segmented:
+        state["mask_assessment_id"] = assessment_id
+
+
+def _cache_results(entries):
+    for image_hash, state in entries:
+        put_cached_result(image_hash, state)
+
+
+def _failure(payload, error):
+    return {
+        "status": "failed",
+        "error": str(error),
+        "patient_id": payload["patient_id"],
+        "patient_name": payload["patient_name"],
+        "image_url": payload["image_url"],
+    }
+
+
+async def run_wound_batch(payloads):
+    """
+    Analyses all images of one visit together and returns one result per payload,
+    in order: the upload response shape on success, or status "failed" with the error.
+    Segmentation and measurement run batched, the LLM stages fan out under
+    BATCH_LLM_CONCURRENCY, and all assessments are written in a single transaction.
+    """
+    results = [None] * len(payloads)
+
+    # Previously analysed photos and duplicates within the visit run the pipeline once
+    first_by_hash = {}
+    pending, duplicates = [], []
+    # Images answered without running the pipeline; they are still logged as assessments
+    reused = {}
+    # The SQLite reads and writes of this function all run off the event loop
+    hits = await asyncio.to_thread(
+        lambda: [get_cached_result(payload["image_hash"]) if payload.get("image_hash") else None for payload in payloads]
+    )
+    for i, (payload, cached) in enumerate(zip(payloads, hits)):
+        image_hash = payload.get("image_hash")
+        if cached:
+            reused[i] = cached_state(payload, cached)
+        elif image_hash in first_by_hash:
+            duplicates.append((i, first_by_hash[image_hash]))
+        else:
+            if image_hash:
+                first_by_hash[image_hash] = i
+            pending.append(i)
+
+    states = {i: build_initial_state(payloads[i]) for i in pending}
+    if states:
+        try:
+            measured = await _measure_all([state["analysis_image_path"] for state in states.values()])
+        except Exception as e:
+            print(f"Batch measurement failed: {e}")
+            for i in pending:
+                results[i] = _failure(payloads[i], e)
+            states = {}
+        else:
+            for state, update in zip(states.values(), measured):
+                _apply(state, update)
+
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    outcomes = await asyncio.gather(
+        *(_run_llm_stages(state, semaphore) for state in states.values()), return_exceptions=True
+    )
+    finished = []
+    for (i, state), outcome in zip(states.items(), outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"Batch image {i} failed: {outcome}")
+            results[i] = _failure(payloads[i], outcome)
+        else:
+            finished.append((i, state))
+
+    analysed = dict(finished)
+    for i, first in duplicates:
+        source = analysed.get(first)
+        if source is None:
+            results[i] = _failure(payloads[i], results[first]["error"])
+            continue
+        # Same photo as `first`: its result and mask stand for this scan too
+        reused[i] = {
+            **cached_state(payloads[i], {field: source.get(field) for field in CACHED_FIELDS}),
+            "mask": source["mask"],
+            "detection_success": source["detection_success"],
+        }
+
+    logged = sorted([*finished, *reused.items()], key=lambda item: item[0])
+    if logged:
+        try:
+            assessment_ids = await asyncio.to_thread(log_assessments, [assessment_record(state) for _, state in logged])
+        except Exception as e:
+            print(f"Batch logging failed: {e}")
+            for i, _ in logged:
+                results[i] = _failure(payloads[i], e)
+        else:
+            await asyncio.to_thread(_store_masks, assessment_ids, [state for _, state in logged])
+            for i, state in finished:
+                state["status"] = "completed"
+                results[i] = analysis_response(payloads[i], state)
+            await asyncio.to_thread(_cache_results, [
+                (payloads[i]["image_hash"], state) for i, state in finished if payloads[i].get("image_hash")
+            ])
+            for i, state in reused.items():
+                results[i] = analysis_response(payloads[i], state, cached=True)
+
+    print(f"---BATCH ANALYSIS COMPLETE: {len(logged)}/{len(payloads)} ASSESSMENTS LOGGED, {len(finished)} ANALYSED---")
+    return results
@@ -0,0 +1,79 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "static/clinivanta.db"
+
+# Maximum number of simultaneously checked-out connections (one per worker thread is plenty)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+# Tuned for a read-heavy clinical dashboard with short write transactions:
+# WAL lets readers proceed while a writer commits, NORMAL sync is crash-safe under WAL.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",    # 128 MB memory-mapped reads
+)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived SQLite connections.
+    Connections are created lazily, reused LIFO (warm page cache first) and
+    bounded by `size`; callers block until a slot frees up.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=POOL_SIZE):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for one unit of work.
+        Commits on success, rolls back on error, then returns it to the pool.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Closes every idle connection (used before the database file is deleted)."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+pool = ConnectionPool()
+
+def get_connection():
+    """Shortcut for `pool.connection()` used by the *_store modules."""
+    return pool.connection()
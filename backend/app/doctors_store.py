@@ -3,140 +3,266 @@ import os
 import hashlib
 import uuid
 import datetime
-
-DB_PATH = "static/clinivanta.db"
+from app.db import DB_PATH, get_connection
 
 def init_db():
-    """Initializes the SQLite database for Clinivanta AI."""
+    """
+    Initializes the SQLite database for Clinivanta AI.
+    Runs the full DDL and column migrations; call once at startup, not per request.
+    """
     if not os.path.exists("static"):
         os.makedirs("static")
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Doctors table — extended with age, mobile, address
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS doctors (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            hospital TEXT,
-            specialty TEXT,
-            age INTEGER,
-            mobile TEXT,
-            address TEXT,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            reset_token TEXT
-        )
-    ''')
-    
-    # Safe migration: add missing columns if they don't exist yet
-    for col, col_type in [('age', 'INTEGER'), ('mobile', 'TEXT'), ('address', 'TEXT')]:
-        try:
-            cursor.execute(f'ALTER TABLE doctors ADD COLUMN {col} {col_type}')
-        except Exception:
-            pass  # Column already exists
-    
-    # Patients table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS patients (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            age INTEGER,
-            gender TEXT,
-            location TEXT,
-            phone TEXT,
-            email TEXT UNIQUE,
-            notes TEXT,
-            doctor_id TEXT,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (doctor_id) REFERENCES doctors (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        # Doctors table — extended with age, mobile, address
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS doctors (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                hospital TEXT,
+                specialty TEXT,
+                age INTEGER,
+                mobile TEXT,
+                address TEXT,
+                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                reset_token TEXT
+            )
+        ''')
+
+        # Safe migration: add missing columns if they don't exist yet
+        existing = {row[1] for row in cursor.execute('PRAGMA table_info(doctors)')}
+        for col, col_type in [('age', 'INTEGER'), ('mobile', 'TEXT'), ('address', 'TEXT')]:
+            if col not in existing:
+                cursor.execute(f'ALTER TABLE doctors ADD COLUMN {col} {col_type}')
+
+        # Patients table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS patients (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                age INTEGER,
+                gender TEXT,
+                location TEXT,
+                phone TEXT,
+                email TEXT UNIQUE,
+                notes TEXT,
+                doctor_id TEXT,
+                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (doctor_id) REFERENCES doctors (id)
+            )
+        ''')
+        # Case-insensitive patient ID lookups (see patients_store.get_patient_name)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_norm_id ON patients (UPPER(TRIM(id)), doctor_id)')
+
+        # Assessments table — replaces the legacy assessments_history.csv log
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS assessments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                patient_id TEXT,
+                patient_name TEXT,
+                doctor_id TEXT COLLATE NOCASE,
+                length_cm REAL,
+                width_cm REAL,
+                depth_cm REAL,
+                area_cm2 REAL,
+                volume_cm3 REAL,
+                diagnosis TEXT,
+                image_url TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_assessments_doctor_ts ON assessments (doctor_id, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_assessments_patient_ts ON assessments (patient_id, timestamp)')
+
+        # Safe migration: typed columns extracted from the diagnosis at ingest (app/report_classifier.py)
+        existing = {row[1] for row in cursor.execute('PRAGMA table_info(assessments)')}
+        for col, col_type in [
+            ('wagner_grade', 'INTEGER'), ('is_alert', 'INTEGER'), ('alert_flags', 'TEXT'),
+            ('granulation_pct', 'REAL'), ('slough_pct', 'REAL'), ('necrosis_pct', 'REAL'),
+            ('epithelization_pct', 'REAL'), ('exudate_level', 'TEXT'), ('research', 'TEXT'),
+            ('job_id', 'TEXT'),
+        ]:
+            if col not in existing:
+                cursor.execute(f'ALTER TABLE assessments ADD COLUMN {col} {col_type}')
+        # At most one assessment per analysis job, however often the job is resumed
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_assessments_job ON assessments (job_id) WHERE job_id IS NOT NULL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_assessments_doctor_alert ON assessments (doctor_id, is_alert, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_assessments_doctor_grade ON assessments (doctor_id, wagner_grade)')
+
+        # Full-text index over report text (see assessments_store.search_assessments).
+        # External-content table: rows live in `assessments`, triggers keep the index in step.
+        has_fts = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'assessments_fts'"
+        ).fetchone()
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS assessments_fts USING fts5(
+                diagnosis, research,
+                content='assessments', content_rowid='id',
+                tokenize='porter unicode61'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS assessments_fts_insert AFTER INSERT ON assessments BEGIN
+                INSERT INTO assessments_fts (rowid, diagnosis, research)
+                VALUES (new.id, new.diagnosis, new.research);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS assessments_fts_delete AFTER DELETE ON assessments BEGIN
+                INSERT INTO assessments_fts (assessments_fts, rowid, diagnosis, research)
+                VALUES ('delete', old.id, old.diagnosis, old.research);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS assessments_fts_update AFTER UPDATE OF diagnosis, research ON assessments BEGIN
+                INSERT INTO assessments_fts (assessments_fts, rowid, diagnosis, research)
+                VALUES ('delete', old.id, old.diagnosis, old.research);
+                INSERT INTO assessments_fts (rowid, diagnosis, research)
+                VALUES (new.id, new.diagnosis, new.research);
+            END
+        ''')
+        if not has_fts:
+            # First run on an existing database: index the history in one bulk pass
+            cursor.execute("INSERT INTO assessments_fts (assessments_fts) VALUES ('rebuild')")
+
+        # Dashboard aggregates maintained by log_assessment (rebuild with rebuild_aggregates.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS doctor_stats (
+                doctor_id TEXT PRIMARY KEY COLLATE NOCASE,
+                total_scans INTEGER NOT NULL DEFAULT 0,
+                alerts INTEGER NOT NULL DEFAULT 0,
+                grade_1 INTEGER NOT NULL DEFAULT 0,
+                grade_2 INTEGER NOT NULL DEFAULT 0,
+                grade_3 INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS doctor_daily_scans (
+                doctor_id TEXT COLLATE NOCASE,
+                day TEXT NOT NULL,
+                scans INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (doctor_id, day)
+            )
+        ''')
+
+        # Analysis jobs — durable queue for the wound pipeline (see app/jobs.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+
+        # Pipeline results keyed by image content hash + pipeline version (see app/result_cache.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pipeline_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pipeline_cache_lru ON pipeline_cache (last_access)')
+
+        # Research insights keyed by quantized measurement signature (see app/research_cache.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS research_cache (
+                key TEXT PRIMARY KEY,
+                insight TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_research_cache_lru ON research_cache (last_access)')
+
+        # Bit-packed wound masks: byte ranges in per-doctor store files (see app/mask_store.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS assessment_masks (
+                assessment_id INTEGER PRIMARY KEY,
+                doctor_id TEXT COLLATE NOCASE,
+                path TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                nbytes INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                pixels INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_assessment_masks_doctor ON assessment_masks (doctor_id, assessment_id)')
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+def _doctor_to_dict(user):
+    return {
+        "id": user[0], "name": user[1], "email": user[2],
+        "hospital": user[3], "specialty": user[4],
+        "age": user[5], "mobile": user[6], "address": user[7],
+    }
+
 def register_doctor(name, email, password, hospital=""):
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     doctor_id = f"DR-{uuid.uuid4().hex[:6].upper()}"
     p_hash = hash_password(password)
-    
+
     try:
-        cursor.execute('''
-            INSERT INTO doctors (id, name, email, password_hash, hospital)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (doctor_id, name, email, p_hash, hospital))
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            conn.execute('''
+                INSERT INTO doctors (id, name, email, password_hash, hospital)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (doctor_id, name, email, p_hash, hospital))
         return {"id": doctor_id, "name": name, "email": email, "hospital": hospital}
     except sqlite3.IntegrityError:
-        conn.close()
         return None
 
 def authenticate_doctor(email, password):
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     p_hash = hash_password(password)
-    cursor.execute(
-        'SELECT id, name, email, hospital, specialty, age, mobile, address FROM doctors WHERE email = ? AND password_hash = ?',
-        (email, p_hash)
-    )
-    user = cursor.fetchone()
-    conn.close()
-    
+    with get_connection() as conn:
+        user = conn.execute(
+            'SELECT id, name, email, hospital, specialty, age, mobile, address FROM doctors WHERE email = ? AND password_hash = ?',
+            (email, p_hash)
+        ).fetchone()
+
     if user:
-        return {
-            "id": user[0],
-            "name": user[1],
-            "email": user[2],
-            "hospital": user[3],
-            "specialty": user[4],
-            "age": user[5],
-            "mobile": user[6],
-            "address": user[7],
-        }
+        return _doctor_to_dict(user)
     return None
 
+def get_doctor(doctor_id):
+    with get_connection() as conn:
+        user = conn.execute(
+            'SELECT id, name, email, hospital, specialty, age, mobile, address FROM doctors WHERE id = ? COLLATE NOCASE',
+            (str(doctor_id).strip(),)
+        ).fetchone()
+    return _doctor_to_dict(user) if user else None
+
 def update_doctor_profile(doctor_id, name, hospital, specialty, age, mobile, address):
     """Updates editable profile fields for a doctor."""
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE doctors
-        SET name = ?, hospital = ?, specialty = ?, age = ?, mobile = ?, address = ?
-        WHERE id = ?
-    ''', (name, hospital, specialty, age, mobile, address, doctor_id))
-    conn.commit()
-    # Fetch updated record to return
-    cursor.execute(
-        'SELECT id, name, email, hospital, specialty, age, mobile, address FROM doctors WHERE id = ?',
-        (doctor_id,)
-    )
-    user = cursor.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('''
+            UPDATE doctors
+            SET name = ?, hospital = ?, specialty = ?, age = ?, mobile = ?, address = ?
+            WHERE id = ?
+        ''', (name, hospital, specialty, age, mobile, address, doctor_id))
+        # Fetch updated record to return
+        user = conn.execute(
+            'SELECT id, name, email, hospital, specialty, age, mobile, address FROM doctors WHERE id = ?',
+            (doctor_id,)
+        ).fetchone()
     if user:
-        return {
-            "id": user[0], "name": user[1], "email": user[2],
-            "hospital": user[3], "specialty": user[4],
-            "age": user[5], "mobile": user[6], "address": user[7],
-        }
+        return _doctor_to_dict(user)
     return None
 
 def set_reset_token(email, token):
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE doctors SET reset_token = ? WHERE email = ?', (token, email))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('UPDATE doctors SET reset_token = ? WHERE email = ?', (token, email))
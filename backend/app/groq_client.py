@@ -1,78 +1,329 @@
 import os
+import time
 import base64
-from groq import Groq
+import hashlib
+import random
+import asyncio
+import httpx
+from groq import AsyncGroq, APIConnectionError, RateLimitError, InternalServerError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+CHAT_MODEL = "llama-3.3-70b-versatile"
+# Using the requested Llama 4 Scout or latest vision equivalent
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+WHISPER_MODEL = "whisper-large-v3-turbo"
+
+GROQ_TIMEOUT = float(os.environ.get("GROQ_TIMEOUT", "60"))
+GROQ_MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", "3"))
+GROQ_MAX_CONNECTIONS = int(os.environ.get("GROQ_MAX_CONNECTIONS", "20"))
+
+# Per-model cap on in-flight upstream calls so one busy model cannot starve the others
+MODEL_CONCURRENCY = {
+    CHAT_MODEL: int(os.environ.get("GROQ_CHAT_CONCURRENCY", "8")),
+    VISION_MODEL: int(os.environ.get("GROQ_VISION_CONCURRENCY", "4")),
+    WHISPER_MODEL: int(os.environ.get("GROQ_WHISPER_CONCURRENCY", "4")),
+}
+
+# Transient failures worth retrying: timeouts, dropped connections, 429s and 5xx
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+SYSTEM_PROMPT = "You are Clinivanta AI, an institutional-grade AI Clinical Intelligence Engine specializing in wound assessment. Analyze inputs like a senior surgeon. Provide definitive diagnosis, tissue breakdown (granulation/slough/necrosis), exudate levels, and clinical staging (Wagner/NPUAP). Always use ### SECTION: header format in structured reports."
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a model after `failure_threshold` consecutive failures.
+    After `reset_timeout` seconds a single trial call is let through (half-open);
+    its outcome closes the circuit again or re-opens it.
+    """
+
+    # allow() result for the call that holds the half-open trial slot
+    TRIAL = "trial"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """
+        False if the call must not go upstream. TRIAL if it is the half-open probe: the
+        caller then owns the trial slot and must release() it however the call ends.
+        True for an ordinary call while the circuit is closed.
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return self.TRIAL
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self, admission):
+        """
+        Ends a call admitted by allow(). Only the probe frees the trial slot: a call let in
+        while the circuit was closed may finish after it went half-open, and must not
+        let a second probe through.
+        """
+        if admission == self.TRIAL:
+            self._trial_in_flight = False
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+_client = None
+_semaphores = {}
+_breakers = {}
+_inflight = {}
+_coalesced_calls = 0
+
+def _get_client():
+    # Created lazily so the keep-alive pool binds to the server's running event loop
+    global _client
+    if _client is None:
+        _client = AsyncGroq(
+            api_key=os.environ.get("GROQ_API_KEY"),
+            max_retries=0,  # retries are handled by _governed_call with jittered backoff
+            timeout=GROQ_TIMEOUT,
+            http_client=httpx.AsyncClient(
+                timeout=GROQ_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=GROQ_MAX_CONNECTIONS,
+                    max_keepalive_connections=GROQ_MAX_CONNECTIONS,
+                    keepalive_expiry=30.0,
+                ),
+            ),
+        )
+    return _client
+
+def _governor(model):
+    if model not in _semaphores:
+        _semaphores[model] = asyncio.Semaphore(MODEL_CONCURRENCY.get(model, 4))
+        _breakers[model] = CircuitBreaker()
+    return _semaphores[model], _breakers[model]
+
+async def _governed_call(model, make_request):
+    """
+    Runs one upstream request under the model's semaphore and circuit breaker,
+    retrying transient errors with full-jitter exponential backoff.
+    """
+    semaphore, breaker = _governor(model)
+    admission = breaker.allow()
+    if not admission:
+        raise CircuitOpenError(f"{model} is temporarily unavailable (circuit open)")
+
+    try:
+        for attempt in range(GROQ_MAX_RETRIES + 1):
+            try:
+                async with semaphore:
+                    result = await make_request()
+                breaker.record_success()
+                return result
+            except RETRYABLE_ERRORS as e:
+                if attempt == GROQ_MAX_RETRIES:
+                    breaker.record_failure()
+                    raise
+                await _backoff(model, attempt, e)
+            except Exception:
+                # Client errors (bad request, auth) mean the upstream answered: don't trip the breaker
+                breaker.record_success()
+                raise
+    finally:
+        # Also when cancelled: a probe that records no outcome must not hold the trial slot forever
+        breaker.release(admission)
+
+async def _backoff(model, attempt, error):
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+    delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+    print(f"Groq {model} attempt {attempt + 1} failed ({type(error).__name__}); retrying in {delay:.2f}s")
+    await asyncio.sleep(delay)
+
+def _chat_messages(prompt):
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        }
+    ]
+
+
+async def _singleflight(key, make_call):
+    """
+    Coalesces concurrent identical calls: the first caller starts the upstream
+    request and everyone arriving before it finishes awaits the same task.
+    Shielded so one cancelled caller (e.g. a dropped client) does not cancel the rest.
+    """
+    global _coalesced_calls
+    task = _inflight.get(key)
+    if task is not None:
+        _coalesced_calls += 1
+        return await asyncio.shield(task)
+
+    task = asyncio.ensure_future(make_call())
+    _inflight[key] = task
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
 
 class GroqService:
     @staticmethod
-    def get_mixtral_recommendation(prompt: str):
+    async def get_mixtral_recommendation(prompt: str):
         # Using Llama 3.3 as requested by user
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are Clinivanta AI, an institutional-grade AI Clinical Intelligence Engine specializing in wound assessment. Analyze inputs like a senior surgeon. Provide definitive diagnosis, tissue breakdown (granulation/slough/necrosis), exudate levels, and clinical staging (Wagner/NPUAP). Always use ### SECTION: header format in structured reports."
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model="llama-3.3-70b-versatile",
-        )
+        key = (CHAT_MODEL, hashlib.sha256(prompt.encode()).hexdigest())
+        return await _singleflight(key, lambda: GroqService._chat_completion(prompt))
+
+    @staticmethod
+    async def _chat_completion(prompt: str):
+        async def request():
+            return await _get_client().chat.completions.create(
+                messages=_chat_messages(prompt),
+                model=CHAT_MODEL,
+            )
+        chat_completion = await _governed_call(CHAT_MODEL, request)
         return chat_completion.choices[0].message.content
 
     @staticmethod
-    def get_whisper_transcription(audio_file_path: str):
-        with open(audio_file_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(audio_file_path, file.read()),
-                model="whisper-large-v3-turbo",
+    async def stream_mixtral_recommendation(prompt: str):
+        """
+        Yields the Llama 3.3 response incrementally (Groq streaming completions).
+        The model's semaphore is held for the whole stream; only opening the stream
+        is retried, since tokens already sent to a client cannot be taken back.
+        """
+        semaphore, breaker = _governor(CHAT_MODEL)
+        admission = breaker.allow()
+        if not admission:
+            raise CircuitOpenError(f"{CHAT_MODEL} is temporarily unavailable (circuit open)")
+
+        try:
+            async with semaphore:
+                for attempt in range(GROQ_MAX_RETRIES + 1):
+                    try:
+                        stream = await _get_client().chat.completions.create(
+                            messages=_chat_messages(prompt),
+                            model=CHAT_MODEL,
+                            stream=True,
+                        )
+                        break
+                    except RETRYABLE_ERRORS as e:
+                        if attempt == GROQ_MAX_RETRIES:
+                            breaker.record_failure()
+                            raise
+                        await _backoff(CHAT_MODEL, attempt, e)
+                    except Exception:
+                        breaker.record_success()
+                        raise
+
+                try:
+                    async for chunk in stream:
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            yield token
+                except RETRYABLE_ERRORS:
+                    breaker.record_failure()
+                    raise
+                breaker.record_success()
+        finally:
+            # Cancelled, or closed by a consumer that stopped reading
+            breaker.release(admission)
+
+    @staticmethod
+    async def get_whisper_transcription(audio_file_path: str):
+        audio_bytes = await asyncio.to_thread(_read_bytes, audio_file_path)
+
+        async def request():
+            return await _get_client().audio.transcriptions.create(
+                file=(audio_file_path, audio_bytes),
+                model=WHISPER_MODEL,
                 response_format="verbose_json",
             )
+        transcription = await _governed_call(WHISPER_MODEL, request)
         return transcription.text
 
     @staticmethod
-    def get_llama_vision_analysis(image_path: str):
+    async def get_llama_vision_analysis(image_path: str):
         """
         Performs high-fidelity vision analysis using Llama's latest vision models.
         Acts as a surgical MD to provide tissue analysis even if YOLO fails.
         """
         def encode_image(img_path):
-            with open(img_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-
-        base64_image = encode_image(image_path)
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": """
-                            As a Senior Surgeon/MD, perform a high-fidelity analysis of this wound image. 
-                            Provide a detailed clinical assessment including:
-                            - Primary Tissue Types: Identify Granulation, Slough, and Necrotic tissue with estimated percentages.
-                            - Exudate Level: Analyze for None/Low/Moderate/Heavy discharge.
-                            - Peripheral Condition: Check for periwound maceration, erythema, or edema.
-                            - Clinical Staging: Categorize based on Wagner Grade (for diabetic ulcers) or NPUAP Stage.
-                            
-                            Your analysis will be used to generate a structured clinical report. Provide output in clear, medical English.
-                            """},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
+            return base64.b64encode(_read_bytes(img_path)).decode('utf-8')
+
+        base64_image = await asyncio.to_thread(encode_image, image_path)
+
+        async def request():
+            return await _get_client().chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": """
+                                As a Senior Surgeon/MD, perform a high-fidelity analysis of this wound image.
+                                Provide a detailed clinical assessment including:
+                                - Primary Tissue Types: Identify Granulation, Slough, and Necrotic tissue with estimated percentages.
+                                - Exudate Level: Analyze for None/Low/Moderate/Heavy discharge.
+                                - Peripheral Condition: Check for periwound maceration, erythema, or edema.
+                                - Clinical Staging: Categorize based on Wagner Grade (for diabetic ulcers) or NPUAP Stage.
+
+                                Your analysis will be used to generate a structured clinical report. Provide output in clear, medical English.
+                                """},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{base64_image}",
+                                },
                             },
-                        },
-                    ],
-                }
-            ],
-            # Using the requested Llama 4 Scout or latest vision equivalent
-            model="meta-llama/llama-4-scout-17b-16e-instruct", # Fallback to 90b if scout is not in local groq registry yet
-        )
+                        ],
+                    }
+                ],
+                model=VISION_MODEL, # Fallback to 90b if scout is not in local groq registry yet
+            )
+        chat_completion = await _governed_call(VISION_MODEL, request)
         return chat_completion.choices[0].message.content
+
+    @staticmethod
+    def stats():
+        """Breaker state per model and coalesced-call count, for health checks."""
+        return {
+            "circuits": {model: breaker.state for model, breaker in _breakers.items()},
+            "in_flight": len(_inflight),
+            "coalesced_calls": _coalesced_calls,
+        }
+
+    @staticmethod
+    async def aclose():
+        """Closes the pooled HTTP connections (called on server shutdown)."""
+        global _client
+        if _client is not None:
+            await _client.close()
+            _client = None
@@ -0,0 +1,196 @@
+import datetime
+import os
+import numpy as np
+from app.db import get_connection
+from app.cache import TTLCache
+
+ANALYTICS_CACHE_TTL = int(os.environ.get("ANALYTICS_CACHE_TTL", "3600"))
+
+# Weekly buckets in the "trends" series (oldest first)
+TREND_WEEKS = 5
+
+SECONDS_PER_DAY = 86400.0
+
+# Slopes flatter than this (cm²/day) are rounding noise on a constant area, not healing
+MIN_HEALING_SLOPE = 1e-6
+# Closure projections further out than this are not reported (near-flat slopes)
+MAX_PROJECTION_DAYS = 3650
+
+TRAJECTORY_FIELDS = (
+    "patient_id", "patient_name", "scans", "span_days",
+    "area_first_cm2", "area_last_cm2", "area_reduction_pct", "volume_reduction_pct",
+    "area_slope_cm2_per_day", "volume_slope_cm3_per_day", "projected_closure",
+)
+
+# (doctor scope, scan count) -> computed trajectories. A new scan bumps doctor_stats.total_scans,
+# so the key changes on every log_assessment and stale entries simply age out.
+_trajectory_cache = TTLCache(maxsize=256, ttl=ANALYTICS_CACHE_TTL)
+
+
+def _scan_version(doctor_id):
+    with get_connection() as conn:
+        if doctor_id:
+            row = conn.execute(
+                'SELECT total_scans FROM doctor_stats WHERE doctor_id = ?', (str(doctor_id).strip(),)
+            ).fetchone()
+        else:
+            row = conn.execute('SELECT SUM(total_scans) FROM doctor_stats').fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def _load_series(doctor_id):
+    """
+    Reads every scan in scope as parallel arrays.
+    A series is one patient of one doctor; patient IDs are normalised like the registry's
+    (UPPER(TRIM(id))), so 'px-1' and 'PX-1' are one trajectory.
+    """
+    clauses = ["timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"]
+    params = []
+    if doctor_id:
+        clauses.append("doctor_id = ?")
+        params.append(str(doctor_id).strip())
+    with get_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT UPPER(COALESCE(doctor_id, '')) || '|' || UPPER(TRIM(patient_id)), UPPER(TRIM(patient_id)), patient_name,
+                   REPLACE(SUBSTR(timestamp, 1, 19), ' ', 'T'), area_cm2, volume_cm3
+            FROM assessments
+            WHERE {' AND '.join(clauses)}
+        ''', params).fetchall()
+
+    if not rows:
+        return None
+    series, patient_ids, names, stamps, areas, volumes = zip(*rows)
+    return {
+        "series": np.array(series),
+        "patient_id": np.array(patient_ids, dtype=object),
+        "patient_name": np.array(names, dtype=object),
+        "t": np.array(stamps, dtype="datetime64[s]").astype(np.int64) / SECONDS_PER_DAY,
+        "area": np.nan_to_num(np.array(areas, dtype=float)),
+        "volume": np.nan_to_num(np.array(volumes, dtype=float)),
+    }
+
+
+def _group_slopes(group, n, t, y):
+    """Least-squares slope of y over t for every group at once (0 where undefined)."""
+    st = np.bincount(group, t)
+    sy = np.bincount(group, y)
+    stt = np.bincount(group, t * t)
+    sty = np.bincount(group, t * y)
+    denom = n * stt - st * st
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denom > 1e-12, (n * sty - st * sy) / denom, 0.0)
+    return slope
+
+
+def _reduction_pct(first, last):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(first > 0, (first - last) / first * 100.0, 0.0)
+
+
+def _compute(doctor_id):
+    data = _load_series(doctor_id)
+    if data is None:
+        return {"patients": [], "summary": _summarize(None, None), "trends": [None] * TREND_WEEKS}
+
+    _, group, n = np.unique(data["series"], return_inverse=True, return_counts=True)
+    # Contiguous, time-ordered runs per patient so first/last scans are plain index lookups
+    order = np.lexsort((data["t"], group))
+    group = group[order]
+    data = {name: values[order] for name, values in data.items()}
+    starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+    ends = starts + n - 1
+    n = n.astype(float)
+
+    # Days since each patient's first scan keeps the regression well conditioned
+    t = data["t"] - data["t"][starts][group]
+    area, volume = data["area"], data["volume"]
+
+    area_slope = _group_slopes(group, n, t, area)
+    volume_slope = _group_slopes(group, n, t, volume)
+    area_reduction = _reduction_pct(area[starts], area[ends])
+    volume_reduction = _reduction_pct(volume[starts], volume[ends])
+    span_days = t[ends]
+
+    # Linear projection from the latest scan to zero area; only for shrinking wounds
+    tracked = n >= 2
+    shrinking = tracked & (area_slope < -MIN_HEALING_SLOPE)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_to_close = np.where(shrinking, area[ends] / -area_slope, np.nan)
+    healing = shrinking & np.isfinite(days_to_close) & (days_to_close <= MAX_PROJECTION_DAYS)
+    closure_day = data["t"][ends] + np.where(healing, days_to_close, 0.0)
+
+    # Only the JSON shaping is per patient; the arrays are converted to lists in bulk
+    epoch = datetime.datetime(1970, 1, 1)
+    closures = [
+        (epoch + datetime.timedelta(days=day)).strftime("%Y-%m-%d") if heals else None
+        for day, heals in zip(closure_day.tolist(), healing.tolist())
+    ]
+    columns = zip(
+        data["patient_id"][starts].tolist(), data["patient_name"][starts].tolist(), n.astype(int).tolist(),
+        np.round(span_days, 1).tolist(), np.round(area[starts], 2).tolist(), np.round(area[ends], 2).tolist(),
+        np.round(area_reduction, 1).tolist(), np.round(volume_reduction, 1).tolist(),
+        np.round(area_slope, 4).tolist(), np.round(volume_slope, 4).tolist(), closures,
+    )
+    patients = [dict(zip(TRAJECTORY_FIELDS, values)) for values in columns]
+
+    summary = _summarize(
+        {"tracked": tracked, "healing": healing, "area_reduction": area_reduction},
+        span_days + np.where(healing, days_to_close, np.nan)
+    )
+    return {"patients": patients, "summary": summary, "trends": _weekly_trends(group, data["t"], area)}
+
+
+def _summarize(groups, total_healing_days):
+    if groups is None or not groups["tracked"].any():
+        return {"tracked_patients": 0, "success_rate": None, "avg_area_reduction_pct": None, "avg_healing_days": None}
+
+    tracked = groups["tracked"]
+    improving = tracked & (groups["area_reduction"] > 0)
+    healing_days = total_healing_days[groups["healing"]]
+    return {
+        "tracked_patients": int(tracked.sum()),
+        "success_rate": round(float(improving.sum() / tracked.sum() * 100.0), 1),
+        # + 0.0 turns a rounded -0.0 (a tiny mean growth) into 0.0, so it is not shown as "-0%"
+        "avg_area_reduction_pct": round(float(groups["area_reduction"][tracked].mean()), 1) + 0.0,
+        # Median: a few near-flat slopes would otherwise project closures years out
+        "avg_healing_days": round(float(np.median(healing_days))) if healing_days.size else None,
+    }
+
+
+def _weekly_trends(group, t, area):
+    """
+    Share (%) of follow-up scans that showed a smaller wound than the patient's
+    previous scan, for each of the last TREND_WEEKS weeks (None for weeks without follow-ups).
+    """
+    follow_up = group[1:] == group[:-1]
+    improved = (area[1:] < area[:-1])[follow_up]
+    today = np.datetime64(datetime.datetime.now(), "s").astype(np.int64) / SECONDS_PER_DAY
+    weeks_ago = np.floor((today - t[1:][follow_up]) / 7).astype(int)
+
+    in_window = (weeks_ago >= 0) & (weeks_ago < TREND_WEEKS)
+    totals = np.bincount(weeks_ago[in_window], minlength=TREND_WEEKS)
+    wins = np.bincount(weeks_ago[in_window], weights=improved[in_window], minlength=TREND_WEEKS)
+    return [
+        round(float(wins[w] / totals[w] * 100.0), 1) if totals[w] else None
+        for w in reversed(range(TREND_WEEKS))
+    ]
+
+
+def get_healing_trajectories(doctor_id=None):
+    """
+    Per-patient healing trajectories for a doctor (or the whole clinic):
+    area/volume reduction, least-squares healing slopes and a projected closure
+    date, plus doctor-level summary and weekly improvement trends.
+    All patients are computed together with NumPy group reductions; results are
+    cached until the doctor logs another scan.
+    """
+    key = ((str(doctor_id).strip().upper() if doctor_id else "*"), _scan_version(doctor_id))
+    result = _trajectory_cache.get(key)
+    if result is None:
+        result = _compute(doctor_id)
+        _trajectory_cache.set(key, result)
+    return result
+
+
+def cache_stats():
+    return _trajectory_cache.stats()
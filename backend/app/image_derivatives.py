@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import os
+import threading
+from app.uploads import UPLOAD_DIR, PREVIEW_MAX_SIDE, THUMBNAIL_MAX_SIDE
+
+# Resized copies live outside static/ and are only served through the derivative endpoint
+DERIVATIVE_DIR = os.environ.get("DERIVATIVE_DIR", "data/derived")
+# Disk budget for cached derivatives; least recently served files are evicted past it
+DERIVATIVE_CACHE_MAX_BYTES = int(os.environ.get("DERIVATIVE_CACHE_MB", "256")) * 1024 * 1024
+
+# Requested widths snap up to one of these, so the cache holds a bounded set per photo
+DERIVATIVE_WIDTHS = (160, 320, 640, 1024, 1600)
+
+# format → (Pillow format, media type, quality); best first for Accept negotiation
+DERIVATIVE_FORMATS = {
+    "avif": ("AVIF", "image/avif", 60),
+    "webp": ("WEBP", "image/webp", 80),
+    "jpeg": ("JPEG", "image/jpeg", 85),
+}
+
+# Versioned into every ETag so a change of encoder settings invalidates clients too
+DERIVATIVE_VERSION = "1"
+
+_lock = threading.Lock()
+_cache_bytes = None
+_inflight = {}
+
+
+def supported_formats():
+    from PIL import features
+    return [fmt for fmt in DERIVATIVE_FORMATS if fmt != "avif" or features.check("avif")]
+
+
+def snap_width(width):
+    """Smallest configured width >= `width` (the largest one for anything bigger)."""
+    for allowed in DERIVATIVE_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return DERIVATIVE_WIDTHS[-1]
+
+
+def negotiate_format(requested, accept):
+    """Explicit ?format= wins; otherwise the best format the client's Accept header lists."""
+    formats = supported_formats()
+    if requested:
+        if requested not in formats:
+            raise ValueError(f"Unsupported image format '{requested}' (choose from {', '.join(formats)})")
+        return requested
+    accept = accept or ""
+    for fmt in formats:
+        if DERIVATIVE_FORMATS[fmt][1] in accept:
+            return fmt
+    return "jpeg"
+
+
+def source_path(name):
+    """The original upload for a file name from an image_url, or None. Only bare names are accepted."""
+    if not name or name != os.path.basename(name) or name.startswith("."):
+        return None
+    path = os.path.join(UPLOAD_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def derivative_etag(path, width, fmt):
+    """Strong validator: changes whenever the source bytes, the width, the format or the encoder do."""
+    stat = os.stat(path)
+    seed = f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}|{width}|{fmt}|{DERIVATIVE_VERSION}"
+    return f'"{hashlib.sha1(seed.encode()).hexdigest()}"'
+
+
+def _decode_source(path, width):
+    from PIL import Image, ImageOps
+    # The ingest thumbnail or preview is a much cheaper decode than a 12 MP original when it is big enough
+    stem, _ = os.path.splitext(path)
+    for max_side, candidate in ((THUMBNAIL_MAX_SIDE, f"{stem}_thumb.webp"), (PREVIEW_MAX_SIDE, f"{stem}_preview.jpg")):
+        if width <= max_side and os.path.exists(candidate):
+            with Image.open(candidate) as img:
+                if img.width >= width:
+                    path = candidate
+                    break
+    with Image.open(path) as img:
+        img.draft("RGB", (width, width))
+        return ImageOps.exif_transpose(img).convert("RGB")
+
+
+def _render(path, width, fmt, out_path):
+    pil_format, _, quality = DERIVATIVE_FORMATS[fmt]
+    img = _decode_source(path, width)
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), resample=3)  # bicubic
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.{threading.get_ident()}.tmp"
+    img.save(tmp_path, format=pil_format, quality=quality)
+    os.replace(tmp_path, out_path)
+    _account(os.path.getsize(out_path))
+    return out_path
+
+
+def _cached_files(directory=DERIVATIVE_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.endswith(".tmp")]
+
+
+def _account(added):
+    """Adds a new file to the running cache size and evicts least recently served files past the budget."""
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry.stat().st_size for entry in _cached_files())
+        else:
+            _cache_bytes += added
+        if _cache_bytes <= DERIVATIVE_CACHE_MAX_BYTES:
+            return
+        # Serving a file bumps its mtime, so oldest mtime = least recently used
+        entries = sorted(_cached_files(), key=lambda entry: entry.stat().st_mtime)
+        target = DERIVATIVE_CACHE_MAX_BYTES * 0.9
+        for entry in entries:
+            if _cache_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                _cache_bytes -= size
+            except OSError:
+                pass
+
+
+def derivative_path(path, width, fmt):
+    # Keep the source extension in the name: legacy uploads may share a stem (a.jpg, a.png)
+    stem = os.path.basename(path).replace(".", "_")
+    return os.path.join(DERIVATIVE_DIR, f"{stem}_{width}.{fmt}")
+
+
+def get_derivative(path, width, fmt):
+    """Path of the cached derivative, rendering it first if needed (blocking)."""
+    out_path = derivative_path(path, width, fmt)
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(path):
+        try:
+            os.utime(out_path)  # LRU touch
+        except OSError:
+            pass
+        return out_path
+    return _render(path, width, fmt, out_path)
+
+
+async def get_derivative_async(path, width, fmt):
+    """get_derivative() off the event loop; concurrent requests for one derivative share a render."""
+    key = (path, width, fmt)
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.to_thread(get_derivative, path, width, fmt))
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(future)
+
+
+def derivative_url(image_url, width=320, fmt=None):
+    """
+    Derivative endpoint URL for an /static/uploads image_url (None for no image).
+    The one source of every API `thumbnail_url` (upload, job result and history).
+    """
+    if not image_url:
+        return None
+    url = f"/api/v1/images/{os.path.basename(image_url)}?w={width}"
+    return f"{url}&format={fmt}" if fmt else url
+
+
+def is_original(name):
+    """Uploads that are originals rather than ingest derivatives or partial files."""
+    stem = os.path.splitext(name)[0]
+    return not name.startswith(".") and not stem.endswith(("_preview", "_thumb"))
+
+
+def cache_stats():
+    files = _cached_files()
+    return {
+        "files": len(files),
+        "bytes": sum(entry.stat().st_size for entry in files),
+        "budget_bytes": DERIVATIVE_CACHE_MAX_BYTES,
+        "rendering": len(_inflight),
+    }
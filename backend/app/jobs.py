@@ -0,0 +1,294 @@
+import asyncio
+import datetime
+import json
+import os
+import uuid
+from app.db import get_connection
+from app.agents.workflow import app_workflow, assessment_record
+from app.assessments_store import log_assessment
+from app.mask_store import copy_masks
+from app.result_cache import get_cached_result, put_cached_result
+from app.image_derivatives import derivative_url
+
+# Number of analyses allowed to run at once; further uploads wait in the queue
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+
+FINISHED_STATUSES = ("completed", "failed")
+
+# Progress label streamed to the client when each pipeline node finishes
+NODE_STATUS = {
+    "segmentation": "segmented",
+    "measurement": "measured",
+    "research": "researched",
+    "vision": "captioned",
+    "diagnosis": "diagnosed",
+    "persist": "completed",
+}
+
+
+# Streamed analyses outlive their SSE response; strong references keep the tasks alive
+_streamed_analyses = set()
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_job(job_id):
+    """
+    Returns a job record with its decoded result, or None if the ID is unknown.
+    """
+    with get_connection() as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def _set_status(job_id, status, result=None, error=None):
+    with get_connection() as conn:
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+            (status, json.dumps(result) if result is not None else None, error, _now(), job_id)
+        )
+
+
+def _insert_job(job_id, payload):
+    now = _now()
+    with get_connection() as conn:
+        conn.execute(
+            'INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (job_id, "queued", json.dumps(payload), now, now)
+        )
+
+
+def _requeue_unfinished():
+    """IDs of jobs a previous process left queued or running, oldest first; running ones go back to queued."""
+    with get_connection() as conn:
+        pending = conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+    return pending
+
+
+def analysis_response(payload, result, cached=False):
+    """Shapes a workflow (or cached) result into the upload API response."""
+    return {
+        "status": "success",
+        "measurements": result.get("measurements", {}),
+        "analysis": result.get("diagnosis", ""),
+        "research": result.get("research", ""),
+        "patient_id": payload["patient_id"],
+        "patient_name": payload["patient_name"],
+        "image_url": payload["image_url"],
+        "thumbnail_url": derivative_url(payload["image_url"]),
+        "timings": result.get("timings", {}),
+        "cached": cached
+    }
+
+
+def build_initial_state(payload, stream_tokens=False):
+    """Initial AgentState for one upload payload."""
+    return {
+        "image_path": payload["image_path"],
+        # Downscaled preview for the models; jobs queued before ingest derivatives have none
+        "analysis_image_path": payload.get("analysis_image_path") or payload["image_path"],
+        "patient_data": {"id": payload["patient_id"], "name": payload["patient_name"]},
+        "doctor_id": payload.get("doctor_id"),
+        "mask": None,
+        "measurements": {},
+        "caption": "Surgical Scan Analysis",
+        "diagnosis": "",
+        "research": "",
+        "status": "started",
+        "detection_success": False,
+        "timings": {},
+        "stream_tokens": stream_tokens,
+        "job_id": payload.get("job_id"),
+    }
+
+
+def cached_state(payload, cached):
+    """
+    Finished pipeline state for an upload answered from the result cache. Nothing was
+    segmented: the mask, if any, is the stored one of `mask_assessment_id`.
+    """
+    return {**build_initial_state(payload), **cached, "status": "completed"}
+
+
+async def log_cached_result(payload, cached):
+    """
+    A cache hit skips the pipeline, persist node included: the scan is still a new
+    assessment for this patient, so it is logged from the cached fields.
+    """
+    def log():
+        state = cached_state(payload, cached)
+        assessment_id = log_assessment(**assessment_record(state))
+        if state.get("mask_assessment_id"):
+            copy_masks([(state["mask_assessment_id"], assessment_id, state.get("doctor_id"))])
+
+    await asyncio.to_thread(log)
+
+
+async def _produce_wound_analysis(payload, events):
+    """Runs the streamed pipeline, putting (event, data) pairs on `events` and None when done."""
+    try:
+        image_hash = payload.get("image_hash")
+        if image_hash:
+            cached = await asyncio.to_thread(get_cached_result, image_hash)
+            if cached:
+                await log_cached_result(payload, cached)
+                events.put_nowait(("complete", analysis_response(payload, cached, cached=True)))
+                return
+
+        result = {}
+        async for namespace, mode, chunk in app_workflow.astream(
+            build_initial_state(payload, stream_tokens=True),
+            stream_mode=["updates", "custom"],
+            subgraphs=True,
+        ):
+            if mode == "custom":
+                events.put_nowait(("token", chunk))
+                continue
+            for node, update in chunk.items():
+                if not update or node == "measurement_branch":
+                    continue
+                result.update({k: v for k, v in update.items() if k != "timings"})
+                result.setdefault("timings", {}).update(update.get("timings", {}))
+                progress = {"node": node, "status": NODE_STATUS.get(node, node)}
+                if "measurements" in update:
+                    progress["measurements"] = update["measurements"]
+                events.put_nowait(("progress", progress))
+
+        print(f"---STREAMED ANALYSIS COMPLETE: {result.get('status')}---")
+        if image_hash:
+            await asyncio.to_thread(put_cached_result, image_hash, result)
+        events.put_nowait(("complete", analysis_response(payload, result)))
+    finally:
+        events.put_nowait(None)
+
+
+def _analysis_finished(task):
+    _streamed_analyses.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Streamed analysis failed: {task.exception()}")
+
+
+async def stream_wound_analysis(payload):
+    """
+    Runs the pipeline for one upload and yields (event, data) pairs as it goes:
+    a "progress" event per finished node, "token" events while the diagnosis is
+    generated, then "complete" with the same body as the upload endpoint.
+
+    The pipeline runs in its own task and this generator only observes it, so a
+    client that disconnects mid-stream still gets its scan logged and cached.
+    """
+    events = asyncio.Queue()
+    task = asyncio.create_task(_produce_wound_analysis(payload, events))
+    _streamed_analyses.add(task)
+    task.add_done_callback(_analysis_finished)
+    while (event := await events.get()) is not None:
+        yield event
+    # Re-raises a pipeline failure for the caller's error event
+    await task
+
+
+async def run_wound_analysis(payload):
+    """
+    Runs the LangGraph wound pipeline for one queued upload and shapes the API response.
+    Identical images queued back-to-back are answered from the result cache.
+    """
+    image_hash = payload.get("image_hash")
+    if image_hash:
+        cached = await asyncio.to_thread(get_cached_result, image_hash)
+        if cached:
+            print(f"---RESULT CACHE HIT: {image_hash[:12]}---")
+            await log_cached_result(payload, cached)
+            return analysis_response(payload, cached, cached=True)
+
+    initial_state = build_initial_state(payload)
+
+    # Groq calls are awaited on the event loop; the CPU-bound nodes run in LangGraph's executor
+    result = await app_workflow.ainvoke(initial_state)
+    print(f"---ANALYSIS COMPLETE: {result.get('status')}---")
+
+    if image_hash:
+        await asyncio.to_thread(put_cached_result, image_hash, result)
+    return analysis_response(payload, result)
+
+
+class JobQueue:
+    """
+    Durable analysis queue: jobs are written to the SQLite `jobs` table before
+    they are scheduled, and a fixed pool of asyncio workers drains them.
+    Jobs left queued or running by a previous process are resumed on start(); a
+    resumed job that had already logged its assessment reuses it (the runner gets
+    the job ID in its payload, and logging is idempotent per job).
+    All SQLite work runs in threads: the connection pool blocks when it is exhausted.
+    """
+
+    def __init__(self, runner, workers=ANALYSIS_WORKERS):
+        self._runner = runner
+        self._workers = workers
+        self._queue = None
+        self._tasks = []
+        self._waiters = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        pending = await asyncio.to_thread(_requeue_unfinished)
+        for row in pending:
+            self._queue.put_nowait(row[0])
+        if pending:
+            print(f"---JOB QUEUE: RESUMING {len(pending)} PENDING ANALYSES---")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, payload):
+        """Persists a new job and schedules it. Returns the job ID without waiting for the analysis."""
+        job_id = f"JOB-{uuid.uuid4().hex[:12].upper()}"
+        await asyncio.to_thread(_insert_job, job_id, payload)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def wait(self, job_id):
+        """Suspends the caller (not the event loop) until the job has finished."""
+        job = await asyncio.to_thread(get_job, job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return job
+        waiter = self._waiters.setdefault(job_id, asyncio.get_running_loop().create_future())
+        await asyncio.shield(waiter)
+        return await asyncio.to_thread(get_job, job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await asyncio.to_thread(get_job, job_id)
+                if job is None or job["status"] in FINISHED_STATUSES:
+                    continue
+                await asyncio.to_thread(_set_status, job_id, "running")
+                try:
+                    result = await self._runner({**job["payload"], "job_id": job_id})
+                    await asyncio.to_thread(_set_status, job_id, "completed", result=result)
+                except Exception as e:
+                    print(f"Job {job_id} failed: {e}")
+                    await asyncio.to_thread(_set_status, job_id, "failed", error=str(e))
+            finally:
+                waiter = self._waiters.pop(job_id, None)
+                if waiter and not waiter.done():
+                    waiter.set_result(None)
+                self._queue.task_done()
+
+
+analysis_queue = JobQueue(run_wound_analysis)
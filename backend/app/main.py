@@ -1,20 +1,44 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 import shutil
 import os
 import base64
-from app.groq_client import GroqService
-from app.agents.workflow import app_workflow
+import hashlib
+import json
+import time
+from typing import List
+from app.groq_client import GroqService, CircuitOpenError
+from app.jobs import analysis_queue, get_job, stream_wound_analysis
+from app.uploads import ingest_upload, UploadTooLarge
+from app.image_derivatives import derivative_url
+from app.segmentation_service import segmentation_service
+from app.reports import report_renderer
+from app.static_files import ClinicalStaticFiles
+from app.cache import TTLCache
 # from app.elevenlabs_service import eleven_service
 from app.doctors_store import init_db, register_doctor, authenticate_doctor, set_reset_token, update_doctor_profile
 from app.mail_service import mail_service
 
-# Initialize DB
+# Initialize DB schema once at startup (stores reuse pooled connections afterwards)
 init_db()
 
-app = FastAPI(title="Clinivanta AI API - Clinical Intelligence Suite v12")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Segmentation workers load their model once here, before the first scan arrives
+    await segmentation_service.start()
+    # Analysis workers live on the server's event loop; pending jobs resume here after a restart
+    await analysis_queue.start()
+    yield
+    await analysis_queue.stop()
+    await segmentation_service.stop()
+    await report_renderer.stop()
+    await GroqService.aclose()
+
+app = FastAPI(title="Clinivanta AI API - Clinical Intelligence Suite v12", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -23,6 +47,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination and revalidation headers read by history clients
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Initialize directories
@@ -30,59 +56,181 @@ os.makedirs("static/uploads", exist_ok=True)
 os.makedirs("static/audio", exist_ok=True)
 os.makedirs("static/reports", exist_ok=True)
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mount static files (allowlisted subdirectories, cache headers, precompressed variants)
+app.mount("/static", ClinicalStaticFiles(directory="static"), name="static")
 
 @app.post("/api/v1/upload-wound")
-async def upload_wound(image: UploadFile = File(...), patient_id: str = Form("PX-9921"), doctor_id: str = Form(None)):
+async def upload_wound(image: UploadFile = File(...), patient_id: str = Form("PX-9921"), doctor_id: str = Form(None), wait: bool = Form(False)):
+    """
+    Queues a wound scan for analysis and returns its job ID right away.
+    Poll /api/v1/jobs/{job_id} for progress; pass wait=true to receive the
+    finished analysis in this response instead (legacy clients).
+    Re-uploads of an already analysed photo are answered from the result cache.
+    """
     try:
-        # Save image
-        filename = image.filename
-        temp_path = f"static/uploads/{filename}"
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        # Size-capped, hashed while streaming to disk, stored under its content hash
+        stored = await ingest_upload(image)
         
         # Look up patient name from registry (Isolated by doctor_id)
-        from app.patients_store import get_all_patients
-        patients_list = get_all_patients(doctor_id)
+        from app.patients_store import get_patient_name
         p_id_str = str(patient_id).strip().upper()
-        patient_name = next((p['name'] for p in patients_list if str(p['id']).strip().upper() == p_id_str), "Unknown Patient")
+        patient_name = get_patient_name(doctor_id, p_id_str)
         
         print(f"---SURGICAL UPLOAD: Patient {p_id_str} ({patient_name}) associated with Doctor {doctor_id}---")
 
-        # LangGraph Multi-Agent Pipeline V5.1
-        initial_state = {
-            "image_path": temp_path,
-            "patient_data": {"id": patient_id, "name": patient_name},
-            "doctor_id": doctor_id,
-            "mask": None,
-            "measurements": {},
-            "caption": "Surgical Scan Analysis",
-            "diagnosis": "",
-            "research": "",
-            "status": "started",
-            "detection_success": False
-        }
-        
-        # Invoke LangGraph workflow
-        result = app_workflow.invoke(initial_state)
-        
-        # Log to surgical console
-        print(f"---ANALYSIS COMPLETE: {result.get('status')}---")
-        
-        return {
-            "status": "success",
-            "measurements": result.get("measurements", {}),
-            "analysis": result.get("diagnosis", ""),
-            "research": result.get("research", ""),
+        payload = {
+            **stored,
             "patient_id": patient_id,
             "patient_name": patient_name,
-            "image_url": f"/static/uploads/{filename}"
+            "doctor_id": doctor_id,
         }
+
+        # LangGraph Multi-Agent Pipeline V5.5 runs on the analysis worker pool. A duplicate
+        # upload (e.g. a network retry) is still a job: the worker answers it from the result
+        # cache without a pipeline run or model quota, and logs it like any other scan
+        job_id = await analysis_queue.enqueue(payload)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        print(f"Upload Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if wait:
+        job = await analysis_queue.wait(job_id)
+        if job["status"] == "failed":
+            raise HTTPException(status_code=500, detail=job["error"])
+        return {**job["result"], "job_id": job_id}
+
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": f"/api/v1/jobs/{job_id}",
+        "result_url": f"/api/v1/jobs/{job_id}/result",
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "image_url": stored["image_url"],
+        "thumbnail_url": derivative_url(stored["image_url"])
+    })
+
+@app.post("/api/v1/upload-wounds/batch")
+async def upload_wound_batch(
+    images: List[UploadFile] = File(...),
+    patient_ids: List[str] = Form(...),
+    doctor_id: str = Form(None)
+):
+    """
+    Analyses every wound photographed during one visit in a single request.
+    Send one `patient_ids` field per image (or a single one shared by all images).
+    Returns a result per image, in upload order; failures do not fail the batch.
+    """
+    from app.batch import run_wound_batch, BATCH_MAX_IMAGES
+    from app.patients_store import get_patient_name
+
+    if len(images) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+    if len(patient_ids) not in (1, len(images)):
+        raise HTTPException(status_code=400, detail="Send one patient_id per image, or a single one for all")
+    if len(patient_ids) == 1:
+        patient_ids = patient_ids * len(images)
+
+    payloads = []
+    try:
+        for image, patient_id in zip(images, patient_ids):
+            # Content-addressed names: same-named phone photos (image.jpg, image.jpg, ...) never collide
+            stored = await ingest_upload(image)
+            p_id_str = str(patient_id).strip().upper()
+            payloads.append({
+                **stored,
+                "patient_id": patient_id,
+                "patient_name": get_patient_name(doctor_id, p_id_str),
+                "doctor_id": doctor_id,
+            })
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        print(f"Batch Upload Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    print(f"---SURGICAL BATCH UPLOAD: {len(payloads)} images for Doctor {doctor_id}---")
+    start = time.perf_counter()
+    results = await run_wound_batch(payloads)
+    failed = sum(1 for result in results if result["status"] == "failed")
+
+    return {
+        "status": "success" if not failed else ("failed" if failed == len(results) else "partial"),
+        "count": len(results),
+        "failed": failed,
+        "elapsed": round(time.perf_counter() - start, 3),
+        "results": results
+    }
+
+@app.post("/api/v1/upload-wound/stream")
+async def upload_wound_stream(image: UploadFile = File(...), patient_id: str = Form("PX-9921"), doctor_id: str = Form(None)):
+    """
+    Server-Sent Events variant of /api/v1/upload-wound.
+    Emits `progress` events as pipeline nodes finish (segmented, measured,
+    researched, ...), `token` events with the diagnosis text as Groq streams it,
+    and a final `complete` event carrying the usual upload response.
+    """
+    try:
+        stored = await ingest_upload(image)
+
+        from app.patients_store import get_patient_name
+        p_id_str = str(patient_id).strip().upper()
+        patient_name = get_patient_name(doctor_id, p_id_str)
+        print(f"---SURGICAL STREAM UPLOAD: Patient {p_id_str} ({patient_name}) associated with Doctor {doctor_id}---")
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print(f"Upload Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    payload = {
+        **stored,
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "doctor_id": doctor_id,
+    }
+
+    async def event_stream():
+        try:
+            async for event, data in stream_wound_analysis(payload):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            print(f"Stream Error: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+@app.get("/api/v1/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "completed":
+        # Still queued or running: tell the client to keep polling
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"]})
+    return {**job["result"], "job_id": job_id}
+
 @app.post("/api/v1/voice-query")
 async def voice_query(audio: UploadFile = File(None), text: str = Form(None), lang: str = Form("en")):
     try:
@@ -93,7 +241,7 @@ async def voice_query(audio: UploadFile = File(None), text: str = Form(None), la
             with open(temp_audio_path, "wb") as buffer:
                 shutil.copyfileobj(audio.file, buffer)
             # Transcription via Whisper Large v3 Turbo
-            user_text = GroqService.get_whisper_transcription(temp_audio_path)
+            user_text = await GroqService.get_whisper_transcription(temp_audio_path)
         elif text:
             user_text = text
         
@@ -109,7 +257,7 @@ async def voice_query(audio: UploadFile = File(None), text: str = Form(None), la
         If they ask for a new scan, tell them to 'Tap the green Plus button'.
         Keep the response professional yet reachable.
         """
-        response_text = GroqService.get_mixtral_recommendation(prompt)
+        response_text = await GroqService.get_mixtral_recommendation(prompt)
         
         # V4.0 Performance Optimization: TTS disabled for high-speed text consulting
         # audio_filename = f"response_{os.urandom(4).hex()}.mp3"
@@ -173,25 +321,23 @@ async def update_profile(data: dict):
 
 @app.get("/api/v1/doctor/stats")
 async def get_doctor_stats(doctor_id: str):
-    from app.patients_store import get_all_patients
-    from app.csv_store import get_assessments
+    from app.patients_store import count_patients
+    from app.assessments_store import get_doctor_aggregates, count_scans_on
+    from app.healing_analytics import get_healing_trajectories
     import datetime
     
-    patients = get_all_patients(doctor_id)
-    assessments = get_assessments()
-    doctor_assessments = [a for a in assessments if a.get("doctor_id") == doctor_id]
-    
     today_str = datetime.datetime.now().strftime("%Y-%m-%d")
-    scans_today = [a for a in doctor_assessments if a.get("timestamp", "").startswith(today_str)]
     
-    # Alerts logic: Any diagnosis mentioning critical surgical terms
-    alerts = [a for a in doctor_assessments if any(word in a.get("diagnosis", "").lower() for word in ['infection', 'critical', 'necrotic', 'high risk', 'emergency'])]
+    # Alerts (diagnoses mentioning critical surgical terms) are counted at write time
+    aggregates = get_doctor_aggregates(doctor_id)
+    # Mean wound-area reduction across patients with follow-up scans
+    reduction = get_healing_trajectories(doctor_id)["summary"]["avg_area_reduction_pct"]
     
     return {
-        "scans_today": len(scans_today),
-        "total_patients": len(patients),
-        "alerts_count": len(alerts),
-        "avg_healing": "84%" # Placeholder for complex logic, but dynamic alerts/scans are now real
+        "scans_today": count_scans_on(doctor_id, today_str),
+        "total_patients": count_patients(doctor_id),
+        "alerts_count": aggregates["alerts"],
+        "avg_healing": f"{reduction:.0f}%" if reduction is not None else "N/A"
     }
 
 @app.get("/api/v1/patients")
@@ -215,47 +361,88 @@ async def get_patient(patient_id: str):
         raise HTTPException(status_code=404, detail="Patient not found")
     return patient
 
+@app.get("/api/v1/patients/{patient_id}/reports.zip")
+async def export_patient_reports(patient_id: str, doctor_id: str = None, since: str = None, until: str = None):
+    """
+    Streams a ZIP of PDF reports, one per assessment (newest first), for a patient
+    (or "all") and an optional date range. Reports render on the worker pool while
+    the archive is written to the response, so memory does not grow with history length.
+    """
+    from app.reports import iter_history, stream_history_zip
+    from app.doctors_store import get_doctor
+
+    rows = iter_history(
+        doctor_id=doctor_id,
+        patient_id=None if patient_id == "all" else patient_id,
+        since=since,
+        until=until,
+    )
+    first = await anext(rows, None)
+    if first is None:
+        raise HTTPException(status_code=404, detail="No assessments in this range")
+
+    async def history():
+        yield first
+        async for row in rows:
+            yield row
+
+    doctor = get_doctor(doctor_id) if doctor_id else None
+    filename = f"{patient_id}_wound_reports.zip".replace('"', "")
+    return StreamingResponse(
+        stream_history_zip(history(), doctor_data=doctor),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.get("/api/v1/intelligence/analytics")
 async def get_analytics(doctor_id: str = None):
-    from app.csv_store import get_assessments
-    all_data = get_assessments()
-    if doctor_id:
-        doc_data = [a for a in all_data if str(a.get("doctor_id")).strip().upper() == str(doctor_id).strip().upper()]
-    else:
-        doc_data = all_data
+    from app.assessments_store import get_doctor_aggregates
+    from app.healing_analytics import get_healing_trajectories
     
-    # Dynamic calculations
-    total_scans = len(doc_data)
-    # Simulate healing rate based on area reduction in history (if same patient has multiple)
-    # For now, providing realistic dynamic stats based on volume
-    success_rate = "94%" if total_scans > 10 else "88%"
-    avg_healing = 12 if total_scans < 5 else 14
-
-    # Wagner breakdown simulation
-    breakdown = {"Grade 1": 0, "Grade 2": 0, "Grade 3": 0}
-    for assessment in doc_data:
-        if not assessment:
-            continue
-        diag = (assessment.get("diagnosis") or "").upper()
-        if "GRADE 1" in diag: breakdown["Grade 1"] += 1
-        elif "GRADE 2" in diag: breakdown["Grade 2"] += 1
-        elif "GRADE 3" in diag: breakdown["Grade 3"] += 1
+    # Dynamic calculations (pre-aggregated by log_assessment)
+    aggregates = get_doctor_aggregates(doctor_id)
+    total_scans = aggregates["total_scans"]
+    # Healing rates from per-patient area trajectories (cached until the next scan)
+    trajectories = get_healing_trajectories(doctor_id)
+    summary = trajectories["summary"]
+    success_rate = f"{summary['success_rate']:.0f}%" if summary["success_rate"] is not None else "N/A"
 
+    # Wagner breakdown maintained at write time
+    breakdown = aggregates["breakdown"]
 
     return {
         "success_rate": success_rate,
         "total_scans": total_scans,
-        "avg_healing_days": avg_healing,
+        "tracked_patients": summary["tracked_patients"],
+        # Kept numeric for the dashboard: 0 when no wound has a projected closure yet
+        "avg_healing_days": summary["avg_healing_days"] or 0,
+        "avg_area_reduction_pct": summary["avg_area_reduction_pct"],
         "breakdown": breakdown,
-        "trends": [85, 88, 90, 92, 94] # Simulated success trend
+        # Weekly % of follow-up scans showing a smaller wound, oldest week first (0 for weeks without follow-ups)
+        "trends": [rate or 0 for rate in trajectories["trends"]]
     }
 
+@app.get("/api/v1/intelligence/trajectories")
+async def get_trajectories(doctor_id: str):
+    """Per-patient healing trajectories: reduction rates, slopes and projected closure dates."""
+    from app.healing_analytics import get_healing_trajectories
+    return get_healing_trajectories(doctor_id)["patients"]
+
+# Short-lived answers per (registry type, query): a ward asking the same thing at once costs one call
+registry_search_cache = TTLCache(maxsize=512, ttl=int(os.environ.get("REGISTRY_SEARCH_TTL", "300")))
+
 @app.get("/api/v1/intelligence/search")
 async def search_medical_registry(query: str, type: str = "pubmed"):
     """
     Clinivanta AI Healthcare MCP search: PubMed, arXiv, Wikipedia, FDA, ICD-10.
     Uses Groq to synthesize authoritative clinical snippets.
+    Identical concurrent searches share one upstream call and recent answers are cached.
     """
+    cache_key = (type, " ".join(query.lower().split()))
+    cached = registry_search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # Registry-specific configurations
     registry_config = {
         "pubmed": {
@@ -300,7 +487,7 @@ Return ONLY a valid JSON object (no markdown fencing) with these exact keys:
 }}"""
     
     try:
-        raw_res = GroqService.get_mixtral_recommendation(prompt)
+        raw_res = await GroqService.get_mixtral_recommendation(prompt)
         import json
         try:
             cleaned = raw_res.strip()
@@ -309,7 +496,7 @@ Return ONLY a valid JSON object (no markdown fencing) with these exact keys:
             elif "```" in cleaned:
                 cleaned = cleaned.split("```")[1].split("```")[0].strip()
             structured = json.loads(cleaned)
-            return {
+            result = {
                 "query": query,
                 "type": type,
                 "title": structured.get("title", f"Clinical Reference: {query}"),
@@ -318,7 +505,7 @@ Return ONLY a valid JSON object (no markdown fencing) with these exact keys:
                 "link": structured.get("link", cfg["link_template"])
             }
         except:
-            return {
+            result = {
                 "query": query,
                 "type": type,
                 "title": f"Clinical Reference: {query}",
@@ -326,6 +513,10 @@ Return ONLY a valid JSON object (no markdown fencing) with these exact keys:
                 "snippet": raw_res,
                 "link": cfg["link_template"]
             }
+        registry_search_cache.set(cache_key, result)
+        return result
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"Registry search unavailable: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Registry search failed: {str(e)}")
 
@@ -341,34 +532,169 @@ async def get_fhir_status():
         "node": "SRG-NODE-772-IN"
     }
 
+@app.get("/api/v1/intelligence/cache-stats")
+async def get_cache_stats():
+    from app.research_cache import research_cache
+    from app.healing_analytics import cache_stats as trajectory_cache_stats
+    from app.mask_store import mask_store_stats
+    from app.image_derivatives import cache_stats as derivative_cache_stats
+    return {
+        "research": research_cache.stats(),
+        "registry_search": registry_search_cache.stats(),
+        "healing_trajectories": trajectory_cache_stats(),
+        "segmentation": segmentation_service.stats(),
+        "mask_store": mask_store_stats(),
+        "pdf_reports": report_renderer.stats(),
+        "image_derivatives": derivative_cache_stats(),
+        "llm": GroqService.stats()
+    }
+
+# Upper bound for one history page; without `limit` the full (legacy) list is returned
+HISTORY_MAX_PAGE = 200
+
+@app.get("/api/v1/assessments/search")
+async def search_assessment_history(q: str, doctor_id: str, limit: int = 20):
+    """
+    Ranked full-text search over a doctor's past diagnoses and research notes
+    (e.g. "slough", "osteomyelitis"). Each hit carries a highlighted snippet.
+    """
+    from app.assessments_store import search_assessments
+
+    try:
+        hits = search_assessments(q, doctor_id, limit=max(1, min(limit, HISTORY_MAX_PAGE)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"---ASSESSMENT SEARCH: '{q}' → {len(hits)} HITS---")
+    return {"query": q, "results": hits}
+
+@app.get("/api/v1/assessments/{assessment_id}/mesh")
+def get_assessment_mesh(assessment_id: int, doctor_id: str = None, max_triangles: int = None):
+    """
+    3D surface mesh of a stored wound mask as binary little-endian buffers
+    (see app.utils.encode_mesh): a 16-byte header, float32 xyz vertices in cm,
+    then uint32 triangle indices. Runs in the threadpool; meshing takes milliseconds.
+    """
+    from app.assessments_store import get_assessment
+    from app.mask_store import load_mask
+    from app.utils import generate_3d_coordinates, encode_mesh, MESH_MAX_TRIANGLES
+
+    assessment = get_assessment(assessment_id, doctor_id=doctor_id)
+    mask = load_mask(assessment_id) if assessment else None
+    if mask is None:
+        raise HTTPException(status_code=404, detail="No stored wound mask for this assessment")
+
+    budget = max(100, min(max_triangles or MESH_MAX_TRIANGLES, MESH_MAX_TRIANGLES))
+    mesh = generate_3d_coordinates(mask, depth_cm=assessment["depth_cm"] or None, max_triangles=budget)
+    return Response(
+        content=encode_mesh(mesh),
+        media_type="application/octet-stream",
+        # Stored masks never change, so the mesh for a given budget is immutable
+        headers={"Cache-Control": "private, max-age=86400"},
+    )
+
+@app.get("/api/v1/images/{name}")
+async def get_image_derivative(name: str, request: Request, w: int = 320, format: str = None):
+    """
+    Resized copy of an uploaded wound photo (the file name from its image_url).
+    `w` snaps up to one of DERIVATIVE_WIDTHS; without `format` the best of
+    AVIF/WebP/JPEG the client accepts is chosen. Derivatives are cached on disk
+    and served with a strong ETag and a year-long immutable Cache-Control.
+    """
+    from fastapi.responses import FileResponse
+    from app.image_derivatives import (
+        source_path, snap_width, negotiate_format, derivative_etag, get_derivative_async, DERIVATIVE_FORMATS,
+    )
+
+    path = source_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        fmt = negotiate_format(format, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    width = snap_width(max(w, 1))
+
+    etag = derivative_etag(path, width, fmt)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if not format:
+        headers["Vary"] = "Accept"
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        out_path = await get_derivative_async(path, width, fmt)
+    except Exception as e:
+        print(f"Image derivative error for {name}: {e}")
+        raise HTTPException(status_code=415, detail="Not a readable image")
+    return FileResponse(out_path, media_type=DERIVATIVE_FORMATS[fmt][1], headers=headers)
+
 @app.get("/api/v1/history/{patient_id}")
-async def get_history(patient_id: str, doctor_id: str = None):
-    from app.csv_store import get_assessments
-    data = get_assessments()
+async def get_history(
+    patient_id: str,
+    request: Request,
+    doctor_id: str = None,
+    alerts_only: bool = False,
+    grade: int = None,
+    since: str = None,
+    until: str = None,
+    fields: str = None,
+    limit: int = None,
+    cursor: str = None
+):
+    """
+    Assessment history, newest first. Paginate with `limit` and the `X-Next-Cursor`
+    response header, trim rows with `fields=id,timestamp,area_cm2,...`, and send
+    `If-None-Match` to get a 304 when the page has not changed.
+    """
+    from app.assessments_store import get_assessments, encode_cursor
     
     print(f"---HISTORY REQUEST: Patient={patient_id}, Doctor={doctor_id}---")
-    print(f"---TOTAL RECORDS IN DB: {len(data)}---")
 
-    if patient_id != "all":
-        data = [a for a in data if a.get("patient_id") == patient_id]
-        print(f"---RECORDS AFTER PATIENT FILTER: {len(data)}---")
+    if limit is not None:
+        limit = max(1, min(limit, HISTORY_MAX_PAGE))
+
+    # Clinical Hardening: doctor_id matching is case-insensitive at the column level
+    try:
+        data = get_assessments(
+            doctor_id=doctor_id,
+            patient_id=None if patient_id == "all" else patient_id,
+            alerts_only=alerts_only,
+            wagner_grade=grade,
+            since=since,
+            until=until,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+            # One extra row tells us whether another page follows
+            limit=limit + 1 if limit is not None else None,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Timeline cards load a small derivative; image_url stays the full-size original
+    for row in data:
+        if row.get("image_url"):
+            row["thumbnail_url"] = derivative_url(row["image_url"])
 
-    if doctor_id:
-        # Clinical Hardening: Case-insensitive match for doctor_id
-        data = [a for a in data if str(a.get("doctor_id")).strip().upper() == str(doctor_id).strip().upper()]
-        print(f"---RECORDS AFTER DOCTOR FILTER: {len(data)}---")
+    headers = {}
+    if limit is not None and len(data) > limit:
+        data = data[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(data[-1])
+    print(f"---RECORDS RETURNED: {len(data)}---")
 
-    return data
+    body = json.dumps(data, separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers["ETag"] = etag
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/api/v1/export-pdf")
 async def export_pdf(data: dict):
     try:
-        filename = f"report_{os.urandom(4).hex()}.pdf"
-        output_path = f"static/reports/{filename}"
-        from app.utils import generate_pdf_report
+        # Rendered on the report worker pool; repeat exports of the same content reuse the file
         # Hardening: Pass doctor data for signature association
-        generate_pdf_report(data.get("patient", {}), data.get("analysis", ""), output_path, doctor_data=data.get("doctor", {}))
-        return {"pdf_url": f"/static/reports/{filename}"}
+        output_path = await report_renderer.render(data.get("patient", {}), data.get("analysis", ""), doctor_data=data.get("doctor", {}))
+        return {"pdf_url": f"/static/reports/{os.path.basename(output_path)}"}
     except Exception as e:
         print(f"PDF Error: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate PDF")
@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import time
+import numpy as np
+from app.db import get_connection
+
+# Kept outside static/ so patient masks are never served by the static mount
+MASK_STORE_DIR = os.environ.get("MASK_STORE_DIR", "data/masks")
+
+_append_lock = threading.Lock()
+# Open read-only maps per store file, remapped when the file has grown past them
+_maps = {}
+
+
+def _store_path(doctor_id):
+    # One append-only file per doctor; doctor IDs are case-insensitive elsewhere too
+    key = re.sub(r"[^a-z0-9_-]", "_", (doctor_id or "unassigned").lower())
+    return os.path.join(MASK_STORE_DIR, f"{key}.bin")
+
+
+def pack_mask(mask):
+    """Bit-packs a 2-D mask (any nonzero = wound): 1/8 of the uint8 size."""
+    return np.packbits(np.asarray(mask, dtype=bool), axis=None)
+
+
+def save_masks(records):
+    """
+    Appends masks to their doctors' store files and indexes them by assessment ID.
+    `records` are (assessment_id, doctor_id, mask) tuples; empty masks are skipped.
+    Returns the number stored.
+    """
+    rows = []
+    with _append_lock:
+        for assessment_id, doctor_id, mask in records:
+            mask = np.asarray(mask)
+            if mask.ndim != 2 or not mask.any():
+                continue
+            packed = pack_mask(mask)
+            path = _store_path(doctor_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(packed.tobytes())
+            rows.append((
+                assessment_id, doctor_id, path, offset, packed.size,
+                mask.shape[0], mask.shape[1], int(np.count_nonzero(mask)), time.time(),
+            ))
+
+    # The index row is the commit point: bytes without one are simply never read
+    with get_connection() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO assessment_masks
+            (assessment_id, doctor_id, path, offset, nbytes, height, width, pixels, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return len(rows)
+
+
+def save_mask(assessment_id, doctor_id, mask):
+    return save_masks([(assessment_id, doctor_id, mask)]) == 1
+
+
+def copy_masks(records):
+    """
+    Indexes already stored masks under further assessments, e.g. a re-upload answered
+    from the result cache. `records` are (source_assessment_id, assessment_id, doctor_id)
+    tuples; the new rows point at the source's bytes, which the append-only store never
+    rewrites. Returns the number copied (sources without a stored mask are skipped).
+    """
+    now = time.time()
+    with get_connection() as conn:
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR REPLACE INTO assessment_masks
+            (assessment_id, doctor_id, path, offset, nbytes, height, width, pixels, created_at)
+            SELECT ?, ?, path, offset, nbytes, height, width, pixels, ?
+            FROM assessment_masks WHERE assessment_id = ?
+        ''', [(assessment_id, doctor_id, now, source_id) for source_id, assessment_id, doctor_id in records])
+        return conn.total_changes - before
+
+
+def _mapped(path, end):
+    mm = _maps.get(path)
+    if mm is None or mm.size < end:
+        mm = np.memmap(path, dtype=np.uint8, mode="r")
+        _maps[path] = mm
+    return mm
+
+
+def _index_rows(assessment_ids):
+    placeholders = ",".join("?" * len(assessment_ids))
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"SELECT * FROM assessment_masks WHERE assessment_id IN ({placeholders})",
+            list(assessment_ids),
+        ).fetchall()
+    return {row["assessment_id"]: row for row in rows}
+
+
+def _packed_view(row):
+    mm = _mapped(row["path"], row["offset"] + row["nbytes"])
+    return mm[row["offset"]:row["offset"] + row["nbytes"]]
+
+
+def load_packed(assessment_id):
+    """
+    Zero-copy view of a stored mask: (packed uint8 bytes backed by the memory map,
+    (height, width)). Returns None if the assessment has no stored mask.
+    """
+    row = _index_rows([assessment_id]).get(assessment_id)
+    if row is None:
+        return None
+    return _packed_view(row), (row["height"], row["width"])
+
+
+def load_mask(assessment_id):
+    """The stored mask as a uint8 (height, width) array of 0/1, or None."""
+    packed = load_packed(assessment_id)
+    if packed is None:
+        return None
+    data, (height, width) = packed
+    return np.unpackbits(data, count=height * width).reshape(height, width)
+
+
+def load_masks(assessment_ids):
+    """
+    Unpacks several masks for batch reprocessing (e.g. MeasurementAgent.calculate_dimensions_batch).
+    Returns (found_ids, masks): masks is an (N, H, W) array when the shapes agree, else a list.
+    """
+    rows = _index_rows(assessment_ids)
+    found = [assessment_id for assessment_id in assessment_ids if assessment_id in rows]
+    masks = [
+        np.unpackbits(_packed_view(rows[i]), count=rows[i]["height"] * rows[i]["width"])
+        .reshape(rows[i]["height"], rows[i]["width"])
+        for i in found
+    ]
+    if masks and len({mask.shape for mask in masks}) == 1:
+        masks = np.stack(masks)
+    return found, masks
+
+
+def list_masks(doctor_id=None):
+    """Assessment IDs with a stored mask, oldest first (optionally for one doctor)."""
+    sql = "SELECT assessment_id FROM assessment_masks"
+    params = []
+    if doctor_id:
+        sql += " WHERE doctor_id = ?"
+        params.append(doctor_id)
+    with get_connection() as conn:
+        return [row[0] for row in conn.execute(sql + " ORDER BY assessment_id", params)]
+
+
+def mask_store_stats():
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0), COALESCE(SUM(height * width), 0) FROM assessment_masks"
+        ).fetchone()
+    count, stored, raw = row[0], row[1], row[2]
+    return {
+        "masks": count,
+        "stored_bytes": stored,
+        "raw_bytes": raw,
+        "ratio": round(stored / raw, 3) if raw else 0,
+    }
@@ -1,47 +1,44 @@
 import sqlite3
 import os
 import uuid
-from app.doctors_store import DB_PATH
+from app.db import get_connection
+from app.cache import TTLCache
+
+# (doctor_id, normalized patient_id) -> name; cleared whenever a patient is registered
+_name_cache = TTLCache(maxsize=2048, ttl=300)
 
 def register_patient(patient_data):
     """
     Persists a new patient to SQLite with doctor association and uniqueness checks.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Uniqueness check for email and phone
     email = patient_data.get("email")
     phone = patient_data.get("phone")
-    
-    cursor.execute('SELECT id FROM patients WHERE email = ? OR phone = ?', (email, phone))
-    if cursor.fetchone():
-        conn.close()
-        return {"error": "Patient with this email or phone already exists in the surgical node."}
-    
+
     px_id = f"PX-{uuid.uuid4().hex[:6].upper()}"
-    
-    cursor.execute('''
-        INSERT INTO patients (id, name, age, gender, location, phone, email, notes, doctor_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        px_id,
-        patient_data.get("name"),
-        patient_data.get("age"),
-        patient_data.get("gender"),
-        patient_data.get("location"),
-        phone,
-        email,
-        patient_data.get("notes"),
-        patient_data.get("doctor_id")
-    ))
-    
+
     try:
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            if conn.execute('SELECT id FROM patients WHERE email = ? OR phone = ?', (email, phone)).fetchone():
+                return {"error": "Patient with this email or phone already exists in the surgical node."}
+
+            conn.execute('''
+                INSERT INTO patients (id, name, age, gender, location, phone, email, notes, doctor_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                px_id,
+                patient_data.get("name"),
+                patient_data.get("age"),
+                patient_data.get("gender"),
+                patient_data.get("location"),
+                phone,
+                email,
+                patient_data.get("notes"),
+                patient_data.get("doctor_id")
+            ))
+        _name_cache.clear()
         return {"id": px_id, "name": patient_data.get("name")}
     except sqlite3.Error as e:
-        conn.close()
         print(f"Database Error: {e}")
         return {"error": str(e)}
 
@@ -49,30 +46,53 @@ def get_all_patients(doctor_id=None):
     """
     Retrieves patients, filtered by doctor if provided.
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    if doctor_id:
-        cursor.execute('SELECT * FROM patients WHERE doctor_id = ? ORDER BY registered_at DESC', (doctor_id,))
-    else:
-        cursor.execute('SELECT * FROM patients ORDER BY registered_at DESC')
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
+    with get_connection() as conn:
+        if doctor_id:
+            rows = conn.execute('SELECT * FROM patients WHERE doctor_id = ? ORDER BY registered_at DESC', (doctor_id,)).fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM patients ORDER BY registered_at DESC').fetchall()
+
     return [dict(row) for row in rows]
 
+def count_patients(doctor_id=None):
+    """
+    Counts registered patients, filtered by doctor if provided.
+    """
+    with get_connection() as conn:
+        if doctor_id:
+            return conn.execute('SELECT COUNT(*) FROM patients WHERE doctor_id = ?', (doctor_id,)).fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
+
 def get_patient_by_id(patient_id):
     """
     Retrieves a single patient by ID.
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM patients WHERE id = ?', (patient_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
+    with get_connection() as conn:
+        row = conn.execute('SELECT * FROM patients WHERE id = ?', (patient_id,)).fetchone()
+
     return dict(row) if row else None
+
+def get_patient_name(doctor_id, patient_id, default="Unknown Patient"):
+    """
+    Resolves a patient's display name by ID (case- and whitespace-insensitive),
+    scoped to the doctor when one is given.
+    Served from a TTL/LRU cache backed by the idx_patients_norm_id expression index.
+    """
+    p_id = str(patient_id).strip().upper()
+    key = (doctor_id, p_id)
+    name = _name_cache.get(key)
+    if name is not None:
+        return name
+
+    with get_connection() as conn:
+        if doctor_id:
+            row = conn.execute(
+                'SELECT name FROM patients WHERE UPPER(TRIM(id)) = ? AND doctor_id = ? LIMIT 1',
+                (p_id, doctor_id)
+            ).fetchone()
+        else:
+            row = conn.execute('SELECT name FROM patients WHERE UPPER(TRIM(id)) = ? LIMIT 1', (p_id,)).fetchone()
+
+    name = row[0] if row else default
+    _name_cache.set(key, name)
+    return name
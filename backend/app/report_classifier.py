@@ -0,0 +1,101 @@
+import re
+
+# Critical surgical terms that flag an assessment as an alert on the dashboard
+ALERT_KEYWORDS = ['infection', 'critical', 'necrotic', 'high risk', 'emergency']
+
+# One compiled alternation finds every alert keyword in a single pass over the text
+_ALERT_PATTERN = re.compile("|".join(re.escape(word) for word in ALERT_KEYWORDS), re.IGNORECASE)
+
+# "### CLINICAL FINDINGS & CLASSIFICATION:" style headers emitted by DiagnosisAgent
+_SECTION_PATTERN = re.compile(r"^\s*#{2,}\s*(.+?)\s*:?\s*$", re.MULTILINE)
+
+_WAGNER_PATTERN = re.compile(r"wagner\s+grade\s*([0-5])\b", re.IGNORECASE)
+_GRADE_PATTERN = re.compile(r"\bgrade\s*([0-5])\b", re.IGNORECASE)
+
+_TISSUE_PATTERN = re.compile(
+    r"(granulation|slough|necrosis|necrotic|epitheli[sz]ation)[^:\n]*:\s*(\d+(?:\.\d+)?)\s*%",
+    re.IGNORECASE
+)
+_TISSUE_COLUMNS = {
+    "granulation": "granulation_pct",
+    "slough": "slough_pct",
+    "necrosis": "necrosis_pct",
+    "necrotic": "necrosis_pct",
+    "epithelization": "epithelization_pct",
+    "epithelisation": "epithelization_pct",
+}
+
+_LEVEL_WORDS = r"(none|minimal|low|scant|moderate|medium|heavy|high|copious)"
+# A level word in the same sentence as "exudate" wins over one elsewhere in the section
+_EXUDATE_PATTERN = re.compile(
+    rf"exudate[^.\n]*?\b{_LEVEL_WORDS}\b|\b{_LEVEL_WORDS}\b[^.\n]*?exudate", re.IGNORECASE
+)
+_LEVEL_PATTERN = re.compile(rf"\b{_LEVEL_WORDS}\b", re.IGNORECASE)
+_EXUDATE_LEVELS = {
+    "none": "None",
+    "minimal": "Low", "low": "Low", "scant": "Low",
+    "moderate": "Moderate", "medium": "Moderate",
+    "heavy": "Heavy", "high": "Heavy", "copious": "Heavy",
+}
+
+# Typed columns stored next to each assessment (see doctors_store.init_db)
+CLASSIFICATION_COLUMNS = (
+    "wagner_grade", "is_alert", "alert_flags",
+    "granulation_pct", "slough_pct", "necrosis_pct", "epithelization_pct",
+    "exudate_level",
+)
+
+
+def split_sections(report):
+    """Maps each `### SECTION:` header (upper-cased) to the text below it."""
+    sections = {}
+    headers = list(_SECTION_PATTERN.finditer(report or ""))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(report)
+        sections[header.group(1).upper()] = report[header.end():end].strip()
+    return sections
+
+
+def _section(sections, keyword):
+    return next((body for name, body in sections.items() if keyword in name), "")
+
+
+def classify_report(report):
+    """
+    Extracts the structured facts the dashboards filter on from a diagnosis report:
+    Wagner grade, alert keywords, tissue composition percentages and exudate level.
+    Missing facts come back as None.
+    """
+    report = report or ""
+    sections = split_sections(report)
+
+    flags = sorted({match.group(0).lower() for match in _ALERT_PATTERN.finditer(report)})
+
+    # Prefer an explicit "Wagner Grade N" in the findings, then any "Grade N" in the report
+    findings = _section(sections, "CLINICAL FINDINGS") or report
+    grade_match = (_WAGNER_PATTERN.search(findings) or _WAGNER_PATTERN.search(report)
+                   or _GRADE_PATTERN.search(report))
+
+    result = {
+        "wagner_grade": int(grade_match.group(1)) if grade_match else None,
+        "is_alert": int(bool(flags)),
+        "alert_flags": ",".join(flags),
+        "granulation_pct": None,
+        "slough_pct": None,
+        "necrosis_pct": None,
+        "epithelization_pct": None,
+        "exudate_level": None,
+    }
+
+    for tissue, pct in _TISSUE_PATTERN.findall(_section(sections, "TISSUE") or report):
+        column = _TISSUE_COLUMNS[tissue.lower()]
+        if result[column] is None:
+            result[column] = float(pct)
+
+    exudate_text = _section(sections, "EXUDATE")
+    match = _EXUDATE_PATTERN.search(exudate_text or report) or _LEVEL_PATTERN.search(exudate_text)
+    if match:
+        level = next(group for group in match.groups() if group)
+        result["exudate_level"] = _EXUDATE_LEVELS[level.lower()]
+
+    return result
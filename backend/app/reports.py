@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+REPORTS_DIR = "static/reports"
+
+# ReportLab layout is pure-Python CPU work: render in separate processes, not on the event loop
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Least recently used cached reports beyond this many files are deleted after each render
+REPORT_CACHE_MAX_FILES = int(os.environ.get("REPORT_CACHE_MAX_FILES", "500"))
+
+# Bulk export: history rows read per page, and reports rendered ahead of the one being streamed
+EXPORT_PAGE_SIZE = 50
+EXPORT_RENDER_AHEAD = int(os.environ.get("EXPORT_RENDER_AHEAD", str(max(2, REPORT_WORKERS * 2))))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _render_in_worker(patient_data, analysis, output_path, doctor_data):
+    from app.utils import generate_pdf_report
+    # Write to a temporary name so a half-written file is never served from the cache
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        generate_pdf_report(patient_data, analysis, tmp_path, doctor_data=doctor_data)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return output_path
+
+
+def _touch(path):
+    """Marks a cached report as recently used (_prune evicts by mtime). False if it is gone."""
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+def _image_digest(patient_data):
+    path = (patient_data.get("image_path") or "").lstrip("/")
+    if not path or not os.path.exists(path):
+        return ""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def report_key(patient_data, analysis, doctor_data):
+    """Content hash of everything that ends up in the PDF (the image by its bytes, not its path)."""
+    payload = json.dumps([patient_data, analysis, doctor_data], sort_keys=True, default=str)
+    return hashlib.sha256(f"{payload}|{_image_digest(patient_data)}".encode()).hexdigest()
+
+
+def _prune(directory=REPORTS_DIR, max_files=REPORT_CACHE_MAX_FILES):
+    reports = [entry for entry in os.scandir(directory) if entry.name.endswith(".pdf")]
+    if len(reports) <= max_files:
+        return
+    reports.sort(key=lambda entry: entry.stat().st_mtime)
+    from app.static_files import PRECOMPRESSED_DIR
+    for entry in reports[:len(reports) - max_files]:
+        # Precompressed copies made by the /static mount go with the report
+        for path in (entry.path, *(os.path.join(PRECOMPRESSED_DIR, "reports", entry.name + s) for s in (".gz", ".br"))):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ReportRenderer:
+    """
+    Renders PDF reports in a pool of worker processes, cached on disk by content
+    hash: a repeat export of the same assessment returns the existing file, and
+    concurrent exports of it share one render.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS, directory=REPORTS_DIR):
+        self.workers = workers
+        self.directory = directory
+        self.rendered = 0
+        self.hits = 0
+        self._pool = None
+        self._inflight = {}
+
+    def _executor(self):
+        if self._pool is None and self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn, *args):
+        """Runs a picklable function on the render pool (or a thread when REPORT_WORKERS=0)."""
+        pool = self._executor()
+        if pool is None:
+            return await asyncio.to_thread(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+    async def render(self, patient_data, analysis, doctor_data=None):
+        """Returns the path of the PDF for these inputs, rendering it only if it is not cached."""
+        key = await asyncio.to_thread(report_key, patient_data, analysis, doctor_data)
+        output_path = os.path.join(self.directory, f"report_{key[:32]}.pdf")
+        if await asyncio.to_thread(_touch, output_path):
+            self.hits += 1
+            return output_path
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(patient_data, analysis, output_path, doctor_data))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(future)
+
+    async def _render(self, patient_data, analysis, output_path, doctor_data):
+        os.makedirs(self.directory, exist_ok=True)
+        await self.run(_render_in_worker, patient_data, analysis, output_path, doctor_data)
+        self.rendered += 1
+        await asyncio.to_thread(_prune, self.directory)
+        return output_path
+
+    def stats(self):
+        return {"workers": self.workers, "rendered": self.rendered, "cache_hits": self.hits}
+
+
+report_renderer = ReportRenderer()
+
+
+def assessment_report_inputs(row, doctor_data=None):
+    """generate_pdf_report() inputs for one stored assessment row."""
+    patient_data = {
+        "id": row["patient_id"],
+        "name": row["patient_name"],
+        "measurements": {
+            "length": row["length_cm"],
+            "width": row["width_cm"],
+            "depth": row["depth_cm"],
+            "area": row["area_cm2"],
+            "volume": row["volume_cm3"],
+        },
+        "image_path": row["image_url"] or "",
+    }
+    return patient_data, row["diagnosis"], doctor_data
+
+
+def report_filename(row):
+    return f"{row['timestamp'].replace(':', '').replace(' ', '_')}_assessment_{row['id']}.pdf"
+
+
+async def iter_history(doctor_id=None, patient_id=None, since=None, until=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Yields assessment rows newest first, one keyset page in memory at a time.
+    Pages are read in a thread so a long export never blocks the event loop on SQLite.
+    """
+    from app.assessments_store import get_assessments, encode_cursor
+    cursor = None
+    while True:
+        rows = await asyncio.to_thread(
+            get_assessments, doctor_id=doctor_id, patient_id=patient_id, since=since, until=until,
+            limit=page_size, cursor=cursor,
+        )
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        cursor = encode_cursor(rows[-1])
+
+
+class _ZipStream:
+    """Write-only sink for zipfile on a non-seekable stream; collected bytes are drained per chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _copy_chunk(source, entry, sink):
+    chunk = source.read(CHUNK_SIZE)
+    if chunk:
+        entry.write(chunk)
+    return chunk, sink.drain()
+
+
+async def _open_report(task, row, doctor_data, renderer):
+    """Opens the rendered report of `task`, rendering it again if the cache pruned it meanwhile."""
+    path = await task
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        path = await renderer.render(*assessment_report_inputs(row, doctor_data))
+        return open(path, "rb")
+
+
+async def stream_history_zip(rows, doctor_data=None, renderer=None):
+    """
+    Streams a ZIP with one PDF report per assessment row (an async iterable), in order.
+    Up to EXPORT_RENDER_AHEAD reports render in parallel on the worker pool (reusing
+    cached ones) while earlier ones are copied into the archive chunk by chunk, so
+    memory stays flat whatever the history length. A report that cannot be rendered
+    or read is replaced by a short .error.txt entry.
+    """
+    renderer = renderer or report_renderer
+    sink = _ZipStream()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+    pending = []
+    rows = aiter(rows)
+
+    async def schedule():
+        while len(pending) < EXPORT_RENDER_AHEAD:
+            row = await anext(rows, None)
+            if row is None:
+                return
+            task = asyncio.ensure_future(renderer.render(*assessment_report_inputs(row, doctor_data)))
+            pending.append((row, task))
+
+    try:
+        await schedule()
+        while pending:
+            row, task = pending.pop(0)
+            await schedule()
+            name = report_filename(row)
+            try:
+                source = await _open_report(task, row, doctor_data, renderer)
+            except Exception as e:
+                print(f"Bulk export: report for assessment #{row['id']} failed: {e}")
+                archive.writestr(name.replace(".pdf", ".error.txt"), f"Report rendering failed: {e}\n")
+                yield sink.drain()
+                continue
+
+            with source, archive.open(name, "w") as entry:
+                while True:
+                    chunk, data = await asyncio.to_thread(_copy_chunk, source, entry, sink)
+                    if data:
+                        yield data
+                    if not chunk:
+                        break
+            yield sink.drain()
+
+        archive.close()
+        yield sink.drain()
+    finally:
+        # Client went away: stop rendering reports nobody will receive
+        for _, task in pending:
+            task.cancel()
@@ -0,0 +1,98 @@
+import bisect
+import os
+import time
+from app.db import get_connection
+from app.cache import TTLCache
+
+RESEARCH_CACHE_TTL = int(os.environ.get("RESEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+RESEARCH_CACHE_MAX_ROWS = int(os.environ.get("RESEARCH_CACHE_MAX_ROWS", "5000"))
+
+# Bucket edges: protocol advice changes with the wound's size class, not with each millimetre
+AREA_EDGES_CM2 = [1, 5, 10, 25, 50, 100, 200]
+DEPTH_EDGES_CM = [0.5, 1.0, 2.0]
+
+
+def _bucket_label(value, edges, unit):
+    i = bisect.bisect_right(edges, value)
+    if i == 0:
+        return f"<{edges[0]} {unit}"
+    if i == len(edges):
+        return f">={edges[-1]} {unit}"
+    return f"{edges[i - 1]}-{edges[i]} {unit}"
+
+
+def measurement_signature(measurements):
+    """
+    Quantizes wound measurements into a size/depth bucket signature,
+    e.g. "area 25-50 cm² | depth 1.0-2.0 cm".
+    """
+    def _num(key):
+        try:
+            return float(measurements.get(key) or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    area = _bucket_label(_num("area"), AREA_EDGES_CM2, "cm²")
+    depth = _bucket_label(_num("depth"), DEPTH_EDGES_CM, "cm")
+    return f"area {area} | depth {depth}"
+
+
+class ResearchCache:
+    """
+    Two-level memo for research insights: an in-process TTL/LRU cache in front
+    of the SQLite research_cache table, so insights also survive restarts.
+    """
+
+    def __init__(self, ttl=RESEARCH_CACHE_TTL, max_rows=RESEARCH_CACHE_MAX_ROWS):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory = TTLCache(maxsize=256, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        insight = self._memory.get(key)
+        if insight is None:
+            with get_connection() as conn:
+                row = conn.execute(
+                    'SELECT insight FROM research_cache WHERE key = ? AND created_at >= ?',
+                    (key, time.time() - self.ttl)
+                ).fetchone()
+                if row:
+                    conn.execute('UPDATE research_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+            if row:
+                insight = row[0]
+                self._memory.set(key, insight)
+        if insight is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return insight
+
+    def set(self, key, insight):
+        now = time.time()
+        self._memory.set(key, insight)
+        with get_connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO research_cache (key, insight, created_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, insight, now, now)
+            )
+            # Drop expired rows, then the least recently used beyond the row budget
+            conn.execute('DELETE FROM research_cache WHERE created_at < ?', (now - self.ttl,))
+            conn.execute('''
+                DELETE FROM research_cache WHERE key IN (
+                    SELECT key FROM research_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_rows,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+research_cache = ResearchCache()
@@ -0,0 +1,56 @@
+import json
+import os
+import time
+from app.db import get_connection
+from app.agents.workflow import PIPELINE_VERSION
+
+# Total size of cached pipeline results kept on disk before LRU eviction kicks in
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Fields of a finished workflow that do not depend on the patient or doctor.
+# mask_assessment_id is the assessment whose stored mask a cache hit reuses.
+CACHED_FIELDS = ("measurements", "caption", "research", "diagnosis", "mask_assessment_id")
+
+
+def _cache_key(image_hash):
+    # Bumping PIPELINE_VERSION invalidates every cached result at once
+    return f"{image_hash}:{PIPELINE_VERSION}"
+
+
+def get_cached_result(image_hash):
+    """
+    Returns the cached pipeline output for an image hash, or None.
+    A hit refreshes the entry's LRU position.
+    """
+    key = _cache_key(image_hash)
+    with get_connection() as conn:
+        row = conn.execute('SELECT result FROM pipeline_cache WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        conn.execute('UPDATE pipeline_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+    return json.loads(row[0])
+
+
+def put_cached_result(image_hash, workflow_result):
+    """
+    Stores the patient-independent part of a workflow result, then evicts
+    least-recently-used entries until the cache fits RESULT_CACHE_MAX_BYTES.
+    """
+    payload = json.dumps({field: workflow_result.get(field) for field in CACHED_FIELDS})
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO pipeline_cache (key, result, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)',
+            (_cache_key(image_hash), payload, len(payload), now, now)
+        )
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM pipeline_cache').fetchone()[0]
+        if total <= RESULT_CACHE_MAX_BYTES:
+            return
+        excess = total - RESULT_CACHE_MAX_BYTES
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM pipeline_cache ORDER BY last_access'):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        conn.executemany('DELETE FROM pipeline_cache WHERE key = ?', victims)
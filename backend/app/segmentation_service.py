@@ -0,0 +1,144 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes holding a warm segmentation model; 0 runs segmentation in a thread instead
+SEGMENTATION_WORKERS = int(os.environ.get("SEGMENTATION_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Requests arriving within this window are segmented together in one backend call
+SEGMENTATION_BATCH_WINDOW_MS = float(os.environ.get("SEGMENTATION_BATCH_WINDOW_MS", "15"))
+SEGMENTATION_MAX_BATCH = int(os.environ.get("SEGMENTATION_MAX_BATCH", "8"))
+
+_worker_agent = None
+
+
+def _init_worker():
+    # Runs once per worker process: the model is loaded here, not per request
+    global _worker_agent
+    from app.agents.segmentation_agent import SegmentationAgent
+    _worker_agent = SegmentationAgent()
+
+
+def _segment_in_worker(image_paths):
+    return _worker_agent.segment_batch(image_paths)
+
+
+def _ready():
+    return _worker_agent is not None
+
+
+class SegmentationService:
+    """
+    Runs the segmentation backend off the event loop, in a pool of warm worker
+    processes. Individual requests are micro-batched: the first request opens a
+    short window and everything queued before it closes goes to a worker together.
+    """
+
+    def __init__(self, workers=SEGMENTATION_WORKERS, window_ms=SEGMENTATION_BATCH_WINDOW_MS,
+                 max_batch=SEGMENTATION_MAX_BATCH):
+        self.workers = workers
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batches = 0
+        self.images = 0
+        self._pool = None
+        self._queue = None
+        self._collector = None
+        self._inline_agent = None
+        self._running = set()
+
+    async def start(self):
+        """Spawns the workers and waits until each has loaded the model."""
+        self._ensure_started()
+        if self._pool is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self._pool, _ready) for _ in range(self.workers)))
+        print(f"---SEGMENTATION SERVICE READY ({self.workers or 'inline'} workers)---")
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            await asyncio.gather(self._collector, return_exceptions=True)
+            self._collector = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._queue = None
+
+    def _ensure_started(self):
+        # Also started lazily, for scripts that run the workflow without the API lifespan
+        loop = asyncio.get_running_loop()
+        if self._collector is not None and self._collector.get_loop() is loop:
+            return
+        if self.workers > 0 and self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        self._queue = asyncio.Queue()
+        self._collector = asyncio.create_task(self._collect())
+
+    async def segment(self, image_path):
+        """Segments one image; resolves to the backend's result dict (mask, detected, tissue)."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((image_path, future))
+        return await future
+
+    async def segment_batch(self, image_paths):
+        # Queued together, so they land in the same micro-batch(es)
+        return await asyncio.gather(*(self.segment(path) for path in image_paths))
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next window can fill while this one runs
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        paths = [path for path, _ in batch]
+        self.batches += 1
+        self.images += len(paths)
+        try:
+            if self._pool is not None:
+                results = await asyncio.get_running_loop().run_in_executor(self._pool, _segment_in_worker, paths)
+            else:
+                results = await asyncio.to_thread(self._inline_segment, paths)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _inline_segment(self, paths):
+        if self._inline_agent is None:
+            from app.agents.segmentation_agent import SegmentationAgent
+            self._inline_agent = SegmentationAgent()
+        return self._inline_agent.segment_batch(paths)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "batches": self.batches,
+            "images": self.images,
+            "avg_batch": round(self.images / self.batches, 2) if self.batches else 0,
+        }
+
+
+segmentation_service = SegmentationService()
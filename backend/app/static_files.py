@@ -0,0 +1,139 @@
+import gzip
+import mimetypes
+import os
+import re
+import stat
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+# Only these subdirectories of static/ are served; the SQLite database and the
+# legacy CSV sit at the top level and must never be reachable over HTTP
+STATIC_ALLOWED_DIRS = tuple(os.environ.get("STATIC_ALLOWED_DIRS", "uploads,reports,fonts,audio").split(","))
+
+# gzip/brotli variants are written here, mirroring the static/ layout
+PRECOMPRESSED_DIR = os.environ.get("PRECOMPRESSED_DIR", "data/precompressed")
+
+# Worth compressing: text-like formats (ReportLab writes uncompressed page streams) and fonts
+COMPRESSIBLE_EXTENSIONS = {".pdf", ".ttf", ".otf", ".svg", ".csv", ".json", ".txt", ".html", ".css", ".js"}
+MIN_COMPRESS_BYTES = 1024
+
+IMMUTABLE = "private, max-age=31536000, immutable"
+REVALIDATE = "private, no-cache"
+
+# Names derived from the file's content hash (see app/uploads.py and app/reports.py)
+CONTENT_ADDRESSED = re.compile(r"^(report_)?[0-9a-f]{32}(_preview|_thumb)?\.[a-z0-9]+$")
+
+
+def cache_policy(parts):
+    """Cache-Control for a static path split into (subdirectory, ..., file name)."""
+    if parts[0] in ("uploads", "reports") and CONTENT_ADDRESSED.match(parts[-1]):
+        # The URL changes whenever the bytes do, so clients never need to ask again
+        return IMMUTABLE
+    if parts[0] == "fonts":
+        return "public, max-age=2592000"
+    # Everything else is revalidated with its ETag (a cheap 304 when unchanged)
+    return REVALIDATE
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def accepted_encoding(accept_encoding):
+    """Best precompressed encoding the client accepts: br (when brotli is installed), then gzip."""
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        token, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    if "br" in accepted and _brotli() is not None:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def precompressed(full_path, stat_result, relative_path, encoding, directory=PRECOMPRESSED_DIR):
+    """
+    Path and stat of the `encoding` variant of a static file, compressing it on first
+    use. Returns None when compression does not pay off (the identity file is served).
+    """
+    suffix = ".br" if encoding == "br" else ".gz"
+    out_path = os.path.join(directory, relative_path + suffix)
+    try:
+        out_stat = os.stat(out_path)
+        fresh = out_stat.st_mtime >= stat_result.st_mtime
+    except FileNotFoundError:
+        fresh = False
+    if not fresh:
+        with open(full_path, "rb") as f:
+            data = f.read()
+        data = _brotli().compress(data) if encoding == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
+        out_stat = os.stat(out_path)
+    if out_stat.st_size > stat_result.st_size * 0.9:
+        return None
+    return out_path, out_stat
+
+
+class ClinicalStaticFiles(StaticFiles):
+    """
+    The /static mount: serves only STATIC_ALLOWED_DIRS, sets Cache-Control per asset
+    class (immutable for content-addressed uploads and reports), and answers
+    compressible files from precompressed gzip/brotli variants. Range requests
+    (audio seeking, PDF viewers) and ETag/Last-Modified revalidation are handled
+    by FileResponse and StaticFiles on the identity file.
+    """
+
+    def __init__(self, *, directory, allowed_dirs=STATIC_ALLOWED_DIRS, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.allowed_dirs = set(allowed_dirs)
+
+    async def get_response(self, path, scope):
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405, headers={"Allow": "GET, HEAD"})
+
+        parts = path.replace("\\", "/").split("/")
+        if len(parts) < 2 or parts[0] not in self.allowed_dirs or any(part.startswith(".") for part in parts):
+            raise HTTPException(status_code=404)
+        try:
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        except (OSError, ValueError):
+            raise HTTPException(status_code=404)
+        if not stat_result or not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404)
+
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": cache_policy(parts)}
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+
+        _, ext = os.path.splitext(full_path)
+        if ext.lower() in COMPRESSIBLE_EXTENSIONS and stat_result.st_size >= MIN_COMPRESS_BYTES:
+            headers["Vary"] = "Accept-Encoding"
+            encoding = accepted_encoding(request_headers.get("accept-encoding"))
+            # Ranges address the identity bytes, so partial requests skip the encoded variant
+            if encoding and "range" not in request_headers:
+                variant = await anyio.to_thread.run_sync(
+                    precompressed, full_path, stat_result, "/".join(parts), encoding
+                )
+                if variant:
+                    full_path, stat_result = variant
+                    headers["Content-Encoding"] = encoding
+
+        response = FileResponse(full_path, stat_result=stat_result, headers=headers, media_type=media_type)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
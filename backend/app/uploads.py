@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import os
+
+CHUNK_SIZE = 1024 * 1024
+
+UPLOAD_DIR = "static/uploads"
+# Largest accepted wound photo; bigger uploads are cut off mid-stream with a 413
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "20")) * 1024 * 1024
+
+# Derivatives made at ingest: the model input, and a small decode source for thumbnails
+PREVIEW_MAX_SIDE = 1024
+PREVIEW_QUALITY = 85
+THUMBNAIL_MAX_SIDE = 256
+THUMBNAIL_QUALITY = 75
+
+# Leading bytes → stored extension. The extension always comes from the content: bytes
+# that are not a recognised image are stored as .bin, never under the client's name
+# (an uploaded .html or .svg must not be served as active content by /static)
+MAGIC_EXTENSIONS = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF8", ".gif"),
+    (b"BM", ".bmp"),
+)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def _extension(head):
+    for magic, ext in MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return ".bin"
+
+
+async def save_upload(upload, dest_path, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Streams an UploadFile to `dest_path` in chunks, hashing the bytes as they are written.
+    Returns (SHA-256 hex digest, first bytes of the file, size). Raises UploadTooLarge
+    (and removes the partial file) once more than `max_bytes` have arrived.
+    """
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    try:
+        with open(dest_path, "wb") as buffer:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Image exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        os.remove(dest_path)
+        raise
+    return digest.hexdigest(), head, size
+
+
+def make_derivatives(source_path, stem, directory=UPLOAD_DIR):
+    """
+    Decodes the upload once and writes, from that one decode, a normalised preview
+    (EXIF-rotated RGB JPEG, longest side PREVIEW_MAX_SIDE) and a WebP thumbnail.
+    Returns {"preview": path, "thumbnail": path}, or {} if the file is not a readable image.
+    """
+    from PIL import Image, ImageOps
+
+    preview_path = os.path.join(directory, f"{stem}_preview.jpg")
+    thumbnail_path = os.path.join(directory, f"{stem}_thumb.webp")
+    if os.path.exists(preview_path) and os.path.exists(thumbnail_path):
+        return {"preview": preview_path, "thumbnail": thumbnail_path}
+    try:
+        with Image.open(source_path) as img:
+            # JPEG can decode straight at a reduced scale, skipping most of a 12 MP photo
+            img.draft("RGB", (PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+        img.save(preview_path, format="JPEG", quality=PREVIEW_QUALITY, optimize=True)
+        img.thumbnail((THUMBNAIL_MAX_SIDE, THUMBNAIL_MAX_SIDE))
+        img.save(thumbnail_path, format="WEBP", quality=THUMBNAIL_QUALITY)
+    except Exception as e:
+        print(f"Upload derivatives skipped for {source_path}: {e}")
+        return {}
+    return {"preview": preview_path, "thumbnail": thumbnail_path}
+
+
+async def ingest_upload(upload, directory=UPLOAD_DIR, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Ingestion stage for a wound photo: streams it to disk under the size cap while
+    hashing, stores it under a content-derived name (identical photos share one file,
+    different photos never collide), and builds the preview and thumbnail derivatives.
+
+    Returns the upload payload fields: image_path / image_url (original), image_hash,
+    analysis_image_path (preview used by the models) and preview_url. Thumbnails are
+    served by the derivative endpoint (see image_derivatives.derivative_url).
+    """
+    incoming = os.path.join(directory, f".incoming-{os.urandom(8).hex()}")
+    image_hash, head, _ = await save_upload(upload, incoming, max_bytes=max_bytes)
+
+    stem = image_hash[:32]
+    path = os.path.join(directory, f"{stem}{_extension(head)}")
+    if os.path.exists(path):
+        os.remove(incoming)
+    else:
+        os.replace(incoming, path)
+
+    derivatives = await asyncio.to_thread(make_derivatives, path, stem, directory)
+    url = lambda p: "/" + p.replace("\\", "/") if p else None
+    return {
+        "image_path": path,
+        "image_url": url(path),
+        "image_hash": image_hash,
+        "analysis_image_path": derivatives.get("preview", path),
+        "preview_url": url(derivatives.get("preview")),
+    }
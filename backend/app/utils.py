@@ -1,5 +1,7 @@
 import os
 import datetime
+import struct
+import numpy as np
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
@@ -36,58 +38,112 @@ def clean_clinical_text(text):
     text = re.sub(r'\n{3,}', '\n\n', text)
     return text.strip()
 
+# Paragraph and table styles are immutable, so they are built once per process
+STYLES = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle(
+    'SurgicalTitle',
+    parent=STYLES['Heading1'],
+    fontName=BOLD_FONT,
+    fontSize=26,
+    textColor=colors.HexColor('#0F52BA'),
+    spaceAfter=25,
+    alignment=1 # Center
+)
+
+HEADER_STYLE = ParagraphStyle(
+    'SurgicalHeader',
+    parent=STYLES['Heading2'],
+    fontName=BOLD_FONT,
+    fontSize=16,
+    textColor=colors.HexColor('#1E293B'),
+    spaceAfter=12,
+    borderPadding=5,
+    backColor=colors.HexColor('#F8FAFC')
+)
+
+NORMAL_STYLE = ParagraphStyle(
+    'SurgicalNormal',
+    parent=STYLES['Normal'],
+    fontName=MAIN_FONT,
+    fontSize=11,
+    leading=16,
+    textColor=colors.HexColor('#334155'),
+    spaceAfter=10
+)
+
+CENTER_STYLE = ParagraphStyle('CenterStyle', parent=STYLES['Normal'], alignment=1, fontSize=10, textColor=colors.grey)
+
+PATIENT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0F52BA')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F8FAFC')),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor('#1E293B')),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), BOLD_FONT),
+    ('FONTNAME', (0, 1), (-1, -1), MAIN_FONT),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E2E8F0'))
+])
+
+MEASUREMENT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0F52BA')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, -1), MAIN_FONT),
+])
+
+DOCTOR_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F1F5F9')),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E2E8F0')),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, -1), MAIN_FONT),
+])
+
+# Embedded wound photos are drawn at 400x300 pt; 2x that keeps them sharp in print
+REPORT_IMAGE_SIZE = (800, 600)
+REPORT_IMAGE_QUALITY = 85
+
+
+def report_image(path, size=REPORT_IMAGE_SIZE):
+    """
+    The wound photo downscaled to report resolution as an in-memory JPEG,
+    so a 12 MP phone photo does not end up in every PDF. Falls back to the file itself.
+    """
+    import io
+    try:
+        from PIL import Image as PILImage
+        with PILImage.open(path) as img:
+            img = img.convert("RGB")
+            img.thumbnail(size)
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=REPORT_IMAGE_QUALITY, optimize=True)
+        buffer.seek(0)
+        return buffer
+    except Exception as e:
+        print(f"PDF image downscale skipped: {e}")
+        return path
+
+
 def generate_pdf_report(patient_data, analysis, output_path, doctor_data=None):
     """
     Robust PDF generation for surgical wound assessment reports.
     """
     doc = SimpleDocTemplate(output_path, pagesize=letter)
-    styles = getSampleStyleSheet()
     story = []
     
     # Process Analysis Text
     cleaned_analysis = clean_clinical_text(analysis)
 
-    # Custom Styles (Premium Poppins)
-    title_style = ParagraphStyle(
-        'SurgicalTitle',
-        parent=styles['Heading1'],
-        fontName=BOLD_FONT,
-        fontSize=26,
-        textColor=colors.HexColor('#0F52BA'),
-        spaceAfter=25,
-        alignment=1 # Center
-    )
-
-    header_style = ParagraphStyle(
-        'SurgicalHeader',
-        parent=styles['Heading2'],
-        fontName=BOLD_FONT,
-        fontSize=16,
-        textColor=colors.HexColor('#1E293B'),
-        spaceAfter=12,
-        borderPadding=5,
-        backColor=colors.HexColor('#F8FAFC')
-    )
-
-    normal_style = ParagraphStyle(
-        'SurgicalNormal',
-        parent=styles['Normal'],
-        fontName=MAIN_FONT,
-        fontSize=11,
-        leading=16,
-        textColor=colors.HexColor('#334155'),
-        spaceAfter=10
-    )
-
     # Title
-    story.append(Paragraph("SURGICAL ASSESSMENT REPORT", title_style))
-    center_style = ParagraphStyle('CenterStyle', parent=styles['Normal'], alignment=1, fontSize=10, textColor=colors.grey)
-    story.append(Paragraph(f"WoundSense AI • Platinum Suite v3.4.1", center_style))
-    story.append(Paragraph(f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}", center_style))
+    story.append(Paragraph("SURGICAL ASSESSMENT REPORT", TITLE_STYLE))
+    story.append(Paragraph(f"WoundSense AI • Platinum Suite v3.4.1", CENTER_STYLE))
+    story.append(Paragraph(f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}", CENTER_STYLE))
     story.append(Spacer(1, 30))
 
     # Patient Information Table
-    story.append(Paragraph("PATIENT IDENTIFICATION", header_style))
+    story.append(Paragraph("PATIENT IDENTIFICATION", HEADER_STYLE))
     data = [
         ["Clinical Attribute", "Registered Detail"],
         ["Surgical ID", patient_data.get('id', 'PX-9921')],
@@ -96,22 +152,12 @@ def generate_pdf_report(patient_data, analysis, output_path, doctor_data=None):
         ["Risk Assessment", "STABLE - MONITOR"]
     ]
     t = Table(data, colWidths=[180, 320])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0F52BA')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F8FAFC')),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor('#1E293B')),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), BOLD_FONT),
-        ('FONTNAME', (0, 1), (-1, -1), MAIN_FONT),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E2E8F0'))
-    ]))
+    t.setStyle(PATIENT_TABLE_STYLE)
     story.append(t)
     story.append(Spacer(1, 25))
 
     # Measurements
-    story.append(Paragraph("SURGICAL MEASUREMENTS", header_style))
+    story.append(Paragraph("SURGICAL MEASUREMENTS", HEADER_STYLE))
     m = patient_data.get('measurements', {})
     m_data = [
         ["Clinical Metric", "Analysis Value"],
@@ -122,46 +168,35 @@ def generate_pdf_report(patient_data, analysis, output_path, doctor_data=None):
         ["Volumetric Calc", f"{m.get('volume', 0)} cm³"]
     ]
     mt = Table(m_data, colWidths=[250, 250])
-    mt.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0F52BA')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, -1), MAIN_FONT),
-    ]))
+    mt.setStyle(MEASUREMENT_TABLE_STYLE)
     story.append(mt)
     story.append(Spacer(1, 25))
 
     # Doctor Attribution
     if doctor_data:
-        story.append(Paragraph("ASSESSING PHYSICIAN", header_style))
+        story.append(Paragraph("ASSESSING PHYSICIAN", HEADER_STYLE))
         doc_info = [
             ["Physician Name", f"Dr. {doctor_data.get('name', 'Aryan Sharma')}"],
             ["Hospital / Unit", doctor_data.get('hospital', 'City Hospital')],
             ["Consultation ID", f"SRG-{os.urandom(3).hex().upper()}"]
         ]
         dt = Table(doc_info, colWidths=[180, 320])
-        dt.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F1F5F9')),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E2E8F0')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), MAIN_FONT),
-        ]))
+        dt.setStyle(DOCTOR_TABLE_STYLE)
         story.append(dt)
         story.append(Spacer(1, 25))
 
     # AI Analysis
-    story.append(Paragraph("CLINICAL ANALYSIS & RECOMMENDATION", header_style))
-    story.append(Paragraph(cleaned_analysis if cleaned_analysis else "No analysis data available.", normal_style))
+    story.append(Paragraph("CLINICAL ANALYSIS & RECOMMENDATION", HEADER_STYLE))
+    story.append(Paragraph(cleaned_analysis if cleaned_analysis else "No analysis data available.", NORMAL_STYLE))
     story.append(Spacer(1, 25))
 
     # Scanned Wound Image Integration
     img_rel_path = patient_data.get('image_path', '').lstrip('/')
     if img_rel_path and os.path.exists(img_rel_path):
         try:
-            story.append(Paragraph("SCANNED WOUND VISUAL", header_style))
+            story.append(Paragraph("SCANNED WOUND VISUAL", HEADER_STYLE))
             # Standardize image size for the report
-            img = Image(img_rel_path, width=400, height=300)
+            img = Image(report_image(img_rel_path), width=400, height=300)
             img.hAlign = 'CENTER'
             story.append(img)
             story.append(Spacer(1, 25))
@@ -170,16 +205,188 @@ def generate_pdf_report(patient_data, analysis, output_path, doctor_data=None):
 
     # Disclaimer
     story.append(Spacer(1, 40))
-    story.append(Paragraph(f"CONFIDENTIAL: This AI-augmented surgical audit was requested by Dr. {doctor_data.get('name', 'Aryan') if doctor_data else 'Aryan'}. For clinical reference only. Professional MD signature required below.", normal_style))
+    story.append(Paragraph(f"CONFIDENTIAL: This AI-augmented surgical audit was requested by Dr. {doctor_data.get('name', 'Aryan') if doctor_data else 'Aryan'}. For clinical reference only. Professional MD signature required below.", NORMAL_STYLE))
     story.append(Spacer(1, 30))
-    story.append(Paragraph("__________________________", center_style))
-    story.append(Paragraph("Licensed Medical Officer Signature", center_style))
+    story.append(Paragraph("__________________________", CENTER_STYLE))
+    story.append(Paragraph("Licensed Medical Officer Signature", CENTER_STYLE))
 
     doc.build(story)
     return output_path
 
-def generate_3d_coordinates(mask):
+# Triangle budget for wound meshes; the sampling grid is coarsened until a mesh fits
+MESH_MAX_TRIANGLES = int(os.environ.get("MESH_MAX_TRIANGLES", "20000"))
+
+# Binary mesh layout (little-endian): magic, vertex count, face count, depth (cm),
+# then float32 xyz per vertex and uint32 vertex indices per triangle
+MESH_MAGIC = b"WMSH"
+MESH_HEADER = struct.Struct("<4sIIf")
+
+
+def _marching_squares_table():
+    """
+    Filled marching squares: for each of the 16 corner cases, the inside polygon of a
+    cell as local vertex ids, fan-triangulated (every case polygon is convex).
+    Local ids: corners 0-3 (top-left, top-right, bottom-right, bottom-left),
+    edge crossings 4-7 (top, right, bottom, left). Saddles are joined.
+    """
+    perimeter = (0, 4, 1, 5, 2, 6, 3, 7)
+    edge_ends = {4: (0, 1), 5: (1, 2), 6: (3, 2), 7: (0, 3)}
+    table = np.zeros((16, 4, 3), dtype=np.intp)
+    valid = np.zeros((16, 4), dtype=bool)
+    for case in range(16):
+        inside = [bool(case >> corner & 1) for corner in range(4)]
+        polygon = [
+            v for v in perimeter
+            if (inside[v] if v < 4 else inside[edge_ends[v][0]] != inside[edge_ends[v][1]])
+        ]
+        for k in range(len(polygon) - 2):
+            table[case, k] = (polygon[0], polygon[k + 1], polygon[k + 2])
+            valid[case, k] = True
+    return table, valid
+
+
+MS_TRIANGLES, MS_VALID = _marching_squares_table()
+
+
+def _coverage_grid(mask, step):
+    """Mean coverage of step x step blocks, with an empty one-block border."""
+    h, w = mask.shape
+    rows, cols = -(-h // step), -(-w // step)
+    padded = np.zeros((rows * step, cols * step), dtype=np.float32)
+    padded[:h, :w] = mask
+    return np.pad(padded.reshape(rows, step, cols, step).mean(axis=(1, 3)), 1)
+
+
+def _rim_distance(inside):
+    """Distance of every inside sample to the wound rim, in grid steps (repeated erosion)."""
+    dist = np.zeros(inside.shape, dtype=np.float32)
+    current = inside.copy()
+    while current.any():
+        dist += current
+        eroded = current.copy()
+        eroded[1:] &= current[:-1]; eroded[:-1] &= current[1:]
+        eroded[:, 1:] &= current[:, :-1]; eroded[:, :-1] &= current[:, 1:]
+        current = eroded
+    return dist
+
+
+def _triangulate(coverage):
+    """
+    Vectorized marching squares over the coverage grid. Returns (xyz, faces) in grid
+    units: inside samples carry their rim distance as z, contour crossings lie at
+    z = 0 (linearly interpolated on the 0.5 iso-line).
+    """
+    inside = coverage >= 0.5
+    rows, cols = coverage.shape
+    case = (
+        inside[:-1, :-1] * 1 | inside[:-1, 1:] * 2 | inside[1:, 1:] * 4 | inside[1:, :-1] * 8
+    ).astype(np.intp)
+    cells = np.flatnonzero(case)
+    if cells.size == 0:
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.intp)
+    r, c = np.divmod(cells, cols - 1)
+
+    # Global vertex ids: grid corners, then horizontal edges, then vertical edges
+    n_corner = rows * cols
+    n_horizontal = rows * (cols - 1)
+    corner = lambda rr, cc: rr * cols + cc
+    horizontal = lambda rr, cc: n_corner + rr * (cols - 1) + cc
+    vertical = lambda rr, cc: n_corner + n_horizontal + rr * cols + cc
+    ids = np.stack([
+        corner(r, c), corner(r, c + 1), corner(r + 1, c + 1), corner(r + 1, c),
+        horizontal(r, c), vertical(r, c + 1), horizontal(r + 1, c), vertical(r, c),
+    ], axis=1)
+
+    cell_case = case.ravel()[cells]
+    local = MS_TRIANGLES[cell_case][MS_VALID[cell_case]]
+    owner = np.repeat(np.arange(cells.size), MS_VALID[cell_case].sum(axis=1))
+    faces = ids[owner[:, None], local]
+
+    # Keep only referenced vertices, renumbered densely
+    used, faces = np.unique(faces, return_inverse=True)
+    faces = faces.reshape(-1, 3)
+    xyz = np.zeros((used.size, 3), dtype=np.float32)
+    dist = _rim_distance(inside)
+
+    is_corner = used < n_corner
+    rr, cc = np.divmod(used[is_corner], cols)
+    xyz[is_corner] = np.stack([cc, rr, dist[rr, cc]], axis=1)
+
+    is_horizontal = ~is_corner & (used < n_corner + n_horizontal)
+    rr, cc = np.divmod(used[is_horizontal] - n_corner, cols - 1)
+    v0, v1 = coverage[rr, cc], coverage[rr, cc + 1]
+    xyz[is_horizontal] = np.stack([cc + (0.5 - v0) / (v1 - v0), rr, np.zeros_like(v0)], axis=1)
+
+    is_vertical = used >= n_corner + n_horizontal
+    rr, cc = np.divmod(used[is_vertical] - n_corner - n_horizontal, cols)
+    v0, v1 = coverage[rr, cc], coverage[rr + 1, cc]
+    xyz[is_vertical] = np.stack([cc, rr + (0.5 - v0) / (v1 - v0), np.zeros_like(v0)], axis=1)
+    return xyz, faces
+
+
+def generate_3d_coordinates(mask, depth_cm=None, pixel_to_cm=None, max_triangles=MESH_MAX_TRIANGLES):
     """
-    Hypothetical utility to convert 2D mask to 3D point cloud or mesh data.
+    Converts a 2D wound mask into a surface mesh of the wound bed.
+    The rim follows the marching-squares contour at skin level (z = 0) and the bed
+    drops to -depth_cm along an ellipsoidal profile of the distance to the rim.
+    The sampling grid is coarsened until the mesh has at most `max_triangles`.
+
+    Returns {"vertices": float32 (V, 3) in cm, centred on the wound with +y up,
+    "faces": uint32 (F, 3) counter-clockwise seen from +z, "depth_cm", "step_px"}.
     """
-    return {"vertices": [], "faces": []}
+    from app.agents.measurement_agent import MeasurementAgent
+
+    mask = np.asarray(mask).astype(bool)
+    agent = MeasurementAgent(pixel_to_cm=pixel_to_cm)
+    empty = {
+        "vertices": np.zeros((0, 3), dtype=np.float32),
+        "faces": np.zeros((0, 3), dtype=np.uint32),
+        "depth_cm": 0.0,
+        "step_px": 0,
+    }
+    if not mask.any():
+        return empty
+    if depth_cm is None:
+        depth_cm = agent.calculate_dimensions(mask)["depth"]
+
+    # Work on the wound's bounding box only
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    y0, x0 = rows[0], cols[0]
+    crop = mask[y0:rows[-1] + 1, x0:cols[-1] + 1]
+
+    # ~2 triangles per inside grid cell gives the first guess for the step
+    step = max(1, int(np.ceil(np.sqrt(2 * crop.sum() / max(max_triangles, 1)))))
+    while True:
+        xyz, faces = _triangulate(_coverage_grid(crop, step))
+        if len(faces) <= max_triangles or step >= max(crop.shape):
+            break
+        step = max(step + 1, int(np.ceil(step * np.sqrt(len(faces) / max_triangles))))
+    if len(faces) == 0:
+        return empty
+
+    # Grid units → pixels (sample points are block centres; the grid has a one-block border)
+    px = x0 + (xyz[:, 0] - 1) * step + (step - 1) / 2
+    py = y0 + (xyz[:, 1] - 1) * step + (step - 1) / 2
+    cy, cx = np.argwhere(mask).mean(axis=0)
+
+    # Ellipsoidal bed: full depth at the deepest point, vertical walls at the rim
+    dist = xyz[:, 2]
+    t = np.clip((dist - 0.5) / max(dist.max() - 0.5, 0.5), 0, 1)
+    z = np.where(dist > 0, -depth_cm * np.sqrt(t * (2 - t)), 0)
+
+    vertices = np.stack([(px - cx) * agent.pixel_to_cm, (cy - py) * agent.pixel_to_cm, z], axis=1)
+    return {
+        "vertices": vertices.astype(np.float32),
+        # y was flipped to point up, so reverse the winding to stay counter-clockwise
+        "faces": faces[:, ::-1].astype(np.uint32),
+        "depth_cm": float(depth_cm),
+        "step_px": step,
+    }
+
+
+def encode_mesh(mesh):
+    """Packs a generate_3d_coordinates() mesh into the MESH_MAGIC binary layout."""
+    vertices = np.ascontiguousarray(mesh["vertices"], dtype="<f4")
+    faces = np.ascontiguousarray(mesh["faces"], dtype="<u4")
+    header = MESH_HEADER.pack(MESH_MAGIC, len(vertices), len(faces), mesh["depth_cm"])
+    return header + vertices.tobytes() + faces.tobytes()
@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.uploads import UPLOAD_DIR
+from app.image_derivatives import get_derivative, is_original, supported_formats
+
+# Widths the history timeline and the report viewer ask for
+BACKFILL_WIDTHS = (320, 1024)
+
+def backfill(formats=None, widths=BACKFILL_WIDTHS, workers=os.cpu_count() or 2):
+    """
+    Pre-generates image derivatives for every existing upload so the first history
+    load after a deploy does not resize photos on demand. Safe to re-run: cached
+    derivatives newer than their source are skipped.
+    """
+    formats = formats or [fmt for fmt in ("webp", "jpeg") if fmt in supported_formats()]
+    sources = [os.path.join(UPLOAD_DIR, name) for name in sorted(os.listdir(UPLOAD_DIR)) if is_original(name)]
+    jobs = [(path, width, fmt) for path in sources for width in widths for fmt in formats]
+    print(f"Backfilling {len(jobs)} derivatives for {len(sources)} uploads ({', '.join(formats)} at {widths})...")
+
+    def run(job):
+        try:
+            get_derivative(*job)
+            return True
+        except Exception as e:
+            print(f"  skipped {job[0]} ({job[1]}px {job[2]}): {e}")
+            return False
+
+    start = time.perf_counter()
+    # Pillow releases the GIL while decoding, resizing and encoding, so threads scale
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        done = sum(pool.map(run, jobs))
+    print(f"Success: {done}/{len(jobs)} derivatives ready in {time.perf_counter() - start:.1f}s.")
+
+if __name__ == "__main__":
+    # usage: python backfill_derivatives.py [format ...]   e.g. webp avif
+    requested = sys.argv[1:] or None
+    unknown = [fmt for fmt in requested or [] if fmt not in supported_formats()]
+    if unknown:
+        sys.exit(f"Unsupported formats: {', '.join(unknown)} (choose from {', '.join(supported_formats())})")
+    backfill(requested)
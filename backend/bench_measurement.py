@@ -0,0 +1,60 @@
+import sys
+import time
+import numpy as np
+from app.agents.measurement_agent import MeasurementAgent
+
+def legacy_bounding_box(mask, pixel_to_cm=0.04):
+    # The pre-batch implementation: one axis-aligned box over all foreground
+    rows = np.any(mask, axis=1)
+    cols = np.any(mask, axis=0)
+    if not np.any(rows) or not np.any(cols):
+        return {"length": 0, "width": 0, "depth": 0, "area": 0, "volume": 0}
+    rmin, rmax = np.where(rows)[0][[0, -1]]
+    cmin, cmax = np.where(cols)[0][[0, -1]]
+    area_cm2 = round(np.sum(mask) * (pixel_to_cm ** 2), 1)
+    depth_cm = round(max(0.2, min(2.0, np.sqrt(area_cm2) * 0.15)), 1)
+    return {
+        "length": round((rmax - rmin) * pixel_to_cm, 1),
+        "width": round((cmax - cmin) * pixel_to_cm, 1),
+        "depth": depth_cm,
+        "area": area_cm2,
+        "volume": round(area_cm2 * depth_cm * 0.7, 1),
+    }
+
+def synthetic_masks(count, size=640, seed=7):
+    """Elliptical wounds at random positions/orientations, some with a satellite lesion."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    masks = np.zeros((count, size, size), dtype=np.uint8)
+    for i in range(count):
+        cx, cy = rng.uniform(0.3, 0.7, 2) * size
+        a, b = rng.uniform(0.05, 0.25, 2) * size
+        t = rng.uniform(0, np.pi)
+        u = (xx - cx) * np.cos(t) + (yy - cy) * np.sin(t)
+        v = -(xx - cx) * np.sin(t) + (yy - cy) * np.cos(t)
+        masks[i] = (u / a) ** 2 + (v / b) ** 2 <= 1
+        if rng.random() < 0.5:
+            masks[i] |= ((xx - size * 0.1) ** 2 + (yy - size * 0.1) ** 2 <= (size * 0.04) ** 2)
+    return masks
+
+def timed(label, count, fn, repeat=3):
+    best = min(_run(fn) for _ in range(repeat))
+    print(f"  {label:<34} {best * 1000:9.1f} ms   {count / best:8.1f} masks/s")
+
+def _run(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def bench(counts=(1, 8, 32)):
+    agent = MeasurementAgent()
+    print("Measurement throughput (640x640 masks, best of 3)")
+    for count in counts:
+        masks = synthetic_masks(count)
+        print(f"N = {count}")
+        timed("legacy bounding box, per mask", count, lambda: [legacy_bounding_box(m) for m in masks])
+        timed("regions, per-mask loop", count, lambda: [agent.calculate_dimensions(m) for m in masks])
+        timed("regions, one batched call", count, lambda: agent.calculate_dimensions_batch(masks))
+
+if __name__ == "__main__":
+    bench(tuple(int(n) for n in sys.argv[1:]) or (1, 8, 32))
@@ -0,0 +1,14 @@
+from app.doctors_store import init_db
+from app.assessments_store import import_csv_history, CSV_PATH
+
+def import_assessments():
+    print(f"Importing legacy assessment log from: {CSV_PATH}")
+    init_db()
+    imported = import_csv_history()
+    if imported:
+        print(f"Success: {imported} assessments moved into the SQLite 'assessments' table.")
+    else:
+        print("No legacy CSV found (already imported or never created).")
+
+if __name__ == "__main__":
+    import_assessments()
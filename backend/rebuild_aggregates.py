@@ -0,0 +1,13 @@
+from app.doctors_store import init_db
+from app.assessments_store import backfill_classifications, rebuild_aggregates
+
+def rebuild():
+    print("Rebuilding dashboard aggregates from the assessment history...")
+    init_db()
+    classified = backfill_classifications()
+    print(f"Classified {classified} assessments recorded before ingest-time classification.")
+    scanned = rebuild_aggregates()
+    print(f"Success: aggregates recomputed from {scanned} assessments.")
+
+if __name__ == "__main__":
+    rebuild()
@@ -0,0 +1,28 @@
+import sys
+from app.doctors_store import init_db
+from app.mask_store import list_masks, load_masks, mask_store_stats
+from app.agents.measurement_agent import MeasurementAgent
+
+BATCH_SIZE = 64
+
+def remeasure(doctor_id=None, pixel_to_cm=None):
+    """
+    Re-measures stored wound masks without re-running segmentation,
+    e.g. after recalibrating PIXEL_TO_CM. Prints one line per assessment.
+    """
+    init_db()
+    agent = MeasurementAgent(pixel_to_cm=pixel_to_cm)
+    assessment_ids = list_masks(doctor_id)
+    print(f"Re-measuring {len(assessment_ids)} stored masks ({mask_store_stats()})")
+    for i in range(0, len(assessment_ids), BATCH_SIZE):
+        found, masks = load_masks(assessment_ids[i:i + BATCH_SIZE])
+        for assessment_id, measurements in zip(found, agent.calculate_dimensions_batch(masks)):
+            print(f"  #{assessment_id}: area {measurements['area']} cm², "
+                  f"{measurements['length']} x {measurements['width']} cm, {measurements['region_count']} region(s)")
+
+if __name__ == "__main__":
+    # usage: python remeasure_masks.py [doctor_id] [pixel_to_cm]
+    remeasure(
+        sys.argv[1] if len(sys.argv) > 1 else None,
+        float(sys.argv[2]) if len(sys.argv) > 2 else None,
+    )
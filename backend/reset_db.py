@@ -1,6 +1,8 @@
-import sqlite3
 import os
+import shutil
+from app.db import pool, get_connection
 from app.doctors_store import init_db, DB_PATH
+from app.mask_store import MASK_STORE_DIR
 
 def reset_database():
     print(f"Checking for database at: {DB_PATH}")
@@ -12,24 +14,31 @@ def reset_database():
         except Exception as e:
             print(f"Error deleting CSV: {e}")
 
+    pool.close_all()
     if os.path.exists(DB_PATH):
         try:
             os.remove(DB_PATH)
+            # WAL journal side files belong to the deleted database
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(DB_PATH + suffix):
+                    os.remove(DB_PATH + suffix)
             print("Successfully deleted existing database.")
         except Exception as e:
             print(f"Error deleting database: {e}")
     else:
         print("No database found to delete.")
 
+    # Stored masks are only reachable through the database index
+    if os.path.exists(MASK_STORE_DIR):
+        shutil.rmtree(MASK_STORE_DIR, ignore_errors=True)
+        print("Successfully deleted stored wound masks.")
+
     print("Re-initializing database...")
     init_db()
     
     # Optional: Verify the schema
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(patients)")
-    columns = [row[1] for row in cursor.fetchall()]
-    conn.close()
+    with get_connection() as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(patients)").fetchall()]
     
     print(f"Table 'patients' columns: {columns}")
     if 'email' in columns:
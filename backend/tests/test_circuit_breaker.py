@@ -0,0 +1,86 @@
+import asyncio
+
+from app import groq_client
+from app.groq_client import CircuitBreaker, _governed_call
+
+MODEL = "test-model"
+
+
+def _half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    groq_client._semaphores[MODEL] = asyncio.Semaphore(1)
+    groq_client._breakers[MODEL] = breaker
+    return breaker
+
+
+def test_cancelled_probe_releases_the_trial():
+    async def scenario():
+        breaker = _half_open_breaker()
+        started = asyncio.Event()
+
+        async def hanging_request():
+            started.set()
+            await asyncio.sleep(60)
+
+        probe = asyncio.create_task(_governed_call(MODEL, hanging_request))
+        await started.wait()
+        # A second caller is refused while the probe is in flight
+        assert not breaker.allow()
+
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+
+        # The next caller becomes the new probe instead of the circuit staying stuck
+        assert breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_successful_probe_closes_the_circuit():
+    async def scenario():
+        breaker = _half_open_breaker()
+
+        async def request():
+            return "ok"
+
+        assert await _governed_call(MODEL, request) == "ok"
+        assert breaker.state == "closed"
+        assert breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_ordinary_call_keeps_the_probe_slot():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        groq_client._semaphores[MODEL] = asyncio.Semaphore(1)
+        groq_client._breakers[MODEL] = breaker
+        started = asyncio.Event()
+
+        async def hanging_request():
+            started.set()
+            await asyncio.sleep(60)
+
+        # Admitted while the circuit is closed
+        call = asyncio.create_task(_governed_call(MODEL, hanging_request))
+        await started.wait()
+
+        # Meanwhile the circuit trips, goes half-open and a probe takes the trial slot
+        breaker.record_failure()
+        assert breaker.allow() == CircuitBreaker.TRIAL
+
+        call.cancel()
+        try:
+            await call
+        except asyncio.CancelledError:
+            pass
+
+        # The ordinary call ending must not admit a second concurrent probe
+        assert not breaker.allow()
+
+    asyncio.run(scenario())